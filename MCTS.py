@@ -1,5 +1,235 @@
+from collections import OrderedDict
+from game import Game, History, RulesCache
+from game_logic import Geometry, Zobrist
+from utils import dotdict
 import math
+import multiprocessing
 import numpy as np
+import time
+
+
+class Node():
+    """
+    Statistics of one board in the tree, with one slot per action and a last one
+    (index -1) for passing. The arrays are only made once the node is searched through.
+    """
+    __slots__ = ("policy", "visits", "value_sum", "n", "end")
+
+    def __init__(self, end):
+        # initial policy (returned by neural net)
+        self.policy = None
+        # stores #times edge s,a was visited
+        self.visits = None
+        # sum of v value of edge s,a over its visits
+        self.value_sum = None
+        # stores #times board s was visited
+        self.n = 0
+        # stores game.getGameEnded ended for board s
+        self.end = end
+
+    def expand(self, action_size: int):
+        if self.visits is None:
+            self.visits = np.zeros(action_size + 1, dtype=np.int32)
+            self.value_sum = np.zeros(action_size + 1)
+
+    def get_q(self):
+        """
+        Returns:
+            average of v value of every edge, 0 for edges never visited
+        """
+        return self.value_sum/np.maximum(self.visits, 1)
+
+    def backup(self, a: int, v: float):
+        self.visits[a] += 1
+        self.value_sum[a] += v
+        self.n += 1
+
+
+class TranspositionTable():
+    """
+    Nodes of the search by board hash, holding at most capacity of them (None for no bound).
+    Once full it evicts the least recently visited node ("lru"), or the tenth of the nodes
+    with the fewest visits ("visits").
+    """
+
+    def __init__(self, capacity: int = None, evict: str = "lru"):
+        assert(evict in ("lru", "visits"))
+        self.capacity = capacity
+        self.evict = evict
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, s: int):
+        return s in self.entries
+
+    def get(self, s: int):
+        """
+        Returns:
+            node of s or None, counted as a hit or a miss
+        """
+        node = self.entries.get(s)
+        if node is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(s)
+        return node
+
+    def peek(self, s: int):
+        """
+        Returns:
+            node of s or None, without counting it or marking it as visited
+        """
+        return self.entries.get(s)
+
+    def put(self, s: int, node: "Node"):
+        self.entries[s] = node
+        if self.capacity is not None and len(self.entries) > self.capacity:
+            self.__evict()
+        return node
+
+    def values(self):
+        return self.entries.values()
+
+    def retain(self, keys):
+        """
+        forget every node not in keys
+        """
+        self.entries = OrderedDict((s, node) for s, node in self.entries.items() if s in keys)
+
+    def stats(self):
+        """
+        Returns:
+            dict of size, capacity, hits, misses, evictions and hit_rate
+        """
+        total = self.hits + self.misses
+        return {"size": len(self.entries), "capacity": self.capacity, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits/total if total > 0 else 0.0}
+
+    def __evict(self):
+        if self.evict == "lru":
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            return
+
+        # sorting is amortized by making room for a tenth of the capacity at once
+        count = len(self.entries) - self.capacity + max(1, self.capacity//10)
+        for s in sorted(self.entries, key=lambda s: self.entries[s].n)[:count]:
+            del self.entries[s]
+        self.evictions += count
+
+
+class EvalCache(RulesCache):
+    """
+    Network evaluations shared by every MCTS of the process, keyed by (weights, n, zobrist
+    hash of the canonical board). The canonical board is the one of the 8 rotations and
+    reflections with the smallest hash, so symmetric boards are evaluated once.
+    The weights are the version of a Model, new whenever its weights change, and the
+    identity of any other evaluator.
+    """
+
+    def predict_batch(self, nnet, boards: np.ndarray, evaluate):
+        """
+        evaluate: function of an array of canonical boards to (policies, values), called once for all misses
+        Returns:
+            policies turned back to the orientation of boards, values
+        """
+        n = boards.shape[-1]
+        symmetries = np.array(Geometry.get(n, n).symmetries)
+        flat = boards.reshape(len(boards), -1).astype(np.intp)
+        # (N, 8, action_size) boards under every symmetry, and their hashes
+        variants = flat[:, symmetries]
+        hashes = Zobrist.get(n, n).hash_batch(variants)
+        best = hashes.argmin(axis=1)
+        weights = ("version", nnet.version) if hasattr(nnet, "version") else ("id", id(nnet))
+        keys = [(weights, n, int(hashes[i, b])) for i, b in enumerate(best)]
+
+        missing = {}
+        for i, key in enumerate(keys):
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            elif key not in missing:
+                self.misses += 1
+                missing[key] = variants[i, best[i]].reshape(n, n)
+            else:
+                # same board twice in one batch, evaluated once
+                self.hits += 1
+
+        if len(missing) > 0:
+            policies, values = evaluate(np.array(list(missing.values())))
+            for key, policy, v in zip(missing, policies, values):
+                self.entries[key] = (np.array(policy), v)
+
+        results = [self.entries[key] for key in keys]
+        self.resize(self.capacity)
+
+        policies = []
+        for (policy, _), b in zip(results, best):
+            # action i of the canonical board is action symmetries[b][i] of the board
+            turned = np.empty_like(policy)
+            turned[symmetries[b]] = policy
+            policies.append(turned)
+        return policies, [v for _, v in results]
+
+
+class SearchStats():
+    """
+    Timers and counters of the searches of one MCTS, kept only when args.instrument is set.
+    The time of a simulation is split by lap into rules (valid moves, ends, playing and
+    undoing moves), nn (network and evaluation cache), select (PUCT) and backup.
+    end_move adds one row per move to rows, ready for pandas.DataFrame.
+    """
+    phases = ("rules", "nn", "select", "backup")
+
+    def __init__(self):
+        self.rows = []
+        self.last = time.perf_counter()
+
+    def lap(self, phase: str = None):
+        """
+        charge the time since the previous lap to phase, None to only restart the clock
+        """
+        now = time.perf_counter()
+        if phase is not None:
+            self.time[phase] += now - self.last
+        self.last = now
+
+    def start_move(self, mcts: "MCTS"):
+        self.time = dict.fromkeys(SearchStats.phases, 0.0)
+        self.simulations = 0
+        self.depth = 0
+        self.nn_calls = mcts.nn_calls
+        self.rules_cache = Game.cache.hits, Game.cache.misses
+        self.eval_cache = MCTS.eval_cache.hits, MCTS.eval_cache.misses
+        self.start = time.perf_counter()
+
+    def end_move(self, mcts: "MCTS"):
+        seconds = time.perf_counter() - self.start
+        nn_calls = mcts.nn_calls - self.nn_calls
+        row = {"move": mcts.count,
+               "simulations": self.simulations,
+               "seconds": seconds,
+               "simulations_per_second": self.simulations/seconds if seconds > 0 else 0.0,
+               "nn_calls": nn_calls,
+               "nn_latency_ms": 1000*self.time["nn"]/nn_calls if nn_calls > 0 else 0.0}
+        for phase in SearchStats.phases:
+            row[phase + "_seconds"] = self.time[phase]
+        row["tree_size"] = len(mcts.nodes)
+        row["average_depth"] = self.depth/self.simulations if self.simulations > 0 else 0.0
+        row["node_hit_rate"] = mcts.nodes.stats()["hit_rate"]
+        row["rules_cache_hits"] = Game.cache.hits - self.rules_cache[0]
+        row["rules_cache_misses"] = Game.cache.misses - self.rules_cache[1]
+        row["eval_cache_hits"] = MCTS.eval_cache.hits - self.eval_cache[0]
+        row["eval_cache_misses"] = MCTS.eval_cache.misses - self.eval_cache[1]
+        self.rows.append(row)
 
 
 class MCTS():
@@ -8,171 +238,607 @@ class MCTS():
         self.nnet = nnet
         self.args = args
 
-        # stores initial policy (returned by neural net)
-        self.policy = {}
-
-        # average of v value in given state weighted by visit count
-        self.Q_for_s_a = {}
-        # stores #times edge s,a was visited
-        self.N_for_s_a = {}
-
-        # stores #times board s was visited
-        self.N_for_s = {}
-        # stores game.getGameEnded ended for board s
-        self.ends = {}
+        # Node of every board s seen by the search, args.max_nodes bounds how many are kept
+        self.nodes = TranspositionTable(self.args.get("max_nodes"), self.args.get("evict", "lru"))
 
-        # to avoid kos
-        self.latest_two_s_a = []
+        # boards on the current search path, for positional superko
+        self.history = History()
+        # nodes and actions of the current search path, deeper than the depth limit
+        self.path_nodes = [None] * (self.game.get_action_size() + 2)
+        self.path_actions = [0] * (self.game.get_action_size() + 2)
         self.pass_count = 0
+        # policy of the node being expanded times its valid moves
+        self.masked = None
+        # root policy noise of a root-parallel worker, see search_root
+        self.noise = None
+        # root action every descent has to take, for the sequential halving of args.gumbel
+        self.root_action = None
+        # worker processes of root-parallel search, started on first use
+        self.pool = None
 
         # step count how many times the calculate_p_v is called
         self.count = 0
+        # simulations run by all the searches
+        self.simulations = 0
+        # timers and counters of every move, only with args.instrument
+        self.stats = SearchStats() if self.args.get("instrument", False) else None
+        # network calls and the leaves they evaluated, for the effective batch size
+        self.nn_calls = 0
+        self.nn_leaves = 0
 
     def calculate_performance(self):
         total = 0
-        for _, num in self.N_for_s.items():
-            total += num
+        for node in self.nodes.values():
+            total += node.n
         return total/self.count
 
-    def calculate_p_v(self, board, temp=1, exhaust=False, withoutNN=False):
+    def calculate_batch_size(self):
         """
+        Returns:
+            average number of leaves evaluated by one network call
+        """
+        return self.nn_leaves/self.nn_calls if self.nn_calls > 0 else 0
+
+    def calculate_p_v(self, board, temp=1, exhaust=False, withoutNN=False, history=None, count=None):
+        """
+        history: History of the game so far seen from the side of board
+        count: simulations to run, args.tree_search_count when None
         Returns:
             current true P for nnet to learn
         """
-        game_status = self.game.check_is_end(board, 1)
+        action_size = self.game.get_action_size()
+        self.history = history.copy() if history is not None else History()
+        state = self.game.get_state(board, self.history)
+        game_status = state.check_is_end()
 
         # game already ended
         if game_status != 0:
-            return [1/self.game.get_action_size() for a in range(self.game.get_action_size())], game_status
+            return np.full(action_size, 1/action_size), game_status
 
+        if count is None:
+            count = self.args.tree_search_count
         self.count += 1
-        for _ in range(self.args.tree_search_count):
-            self.latest_two_s_a = []
-            self.pass_count = 0
-            self.search(board)
-
-        s = self.game.to_string(board)
-
-        p_counts = [self.N_for_s_a[(s, a)] if (
-            s, a) in self.N_for_s_a else 0 for a in range(self.game.get_action_size())]
-        p_counts = [x**(1./temp) for x in p_counts]
-        p_sum = float(sum(p_counts))
+        if self.stats is not None:
+            self.stats.start_move(self)
+        # args.workers > 1 searches the root in that many processes at once
+        if self.args.get("workers", 1) > 1:
+            root, flipped = self.__search_parallel(board, self.history, count)
+        else:
+            root, flipped = self.search_root(state, count)
+        if self.stats is not None:
+            self.stats.end_move(self)
 
+        # current player skipped play need to count from next player! could be ko
+        if root is None or root.visits is None or not root.visits[:action_size].any():
+            # both evicted already, only with a max_nodes smaller than one search path
+            if flipped is None or flipped.n == 0:
+                return np.full(action_size, 1/action_size), 0
+            v = -float(flipped.value_sum[:action_size].sum())/flipped.n
+            return np.full(action_size, 1/action_size), v
+
+        v = float(root.value_sum[:action_size].sum())/root.n
+        if self.args.get("gumbel", False) and root.policy is not None:
+            return self.__improved_policy(root, state.get_valid_moves()), v
         if withoutNN == True:
-            # current player skipped play need to count from next player! could be ko
-            if p_sum == 0:
-                next_board = self.game.get_standard_board(board, -1)
-                s = self.game.to_string(next_board)
-                v_counts = [self.Q_for_s_a[(s, a)]*self.N_for_s_a[(s, a)] if (
-                    s, a) in self.Q_for_s_a else 0 for a in range(self.game.get_action_size())]
-                v = -float(sum(v_counts))/self.N_for_s[s]
-                return [1/self.game.get_action_size() for a in range(self.game.get_action_size())], v
-            else:
-                v_counts = [self.Q_for_s_a[(s, a)]*self.N_for_s_a[(s, a)] if (
-                    s, a) in self.Q_for_s_a else 0 for a in range(self.game.get_action_size())]
-                v = float(sum(v_counts))/self.N_for_s[s]
-
-                p_counts = [self.Q_for_s_a[(s, a)] + 1 + 1e-12 if (
-                    s, a) in self.Q_for_s_a else 0 for a in range(self.game.get_action_size())]
-
-                p_sum = float(sum(p_counts))
-                p = [x/p_sum for x in p_counts]
-                return p, v
+            p_counts = np.where(root.visits[:action_size] > 0, root.get_q()[:action_size] + 1 + 1e-12, 0)
+        else:
+            p_counts = root.visits[:action_size]**(1./temp)
+        return p_counts/float(p_counts.sum()), v
 
-        # current player skipped play need to count from next player! could be ko
-        if p_sum == 0:
-            next_board = self.game.get_standard_board(board, -1)
-            s = self.game.to_string(next_board)
-            v_counts = [self.Q_for_s_a[(s, a)]*self.N_for_s_a[(s, a)] if (
-                s, a) in self.Q_for_s_a else 0 for a in range(self.game.get_action_size())]
-            v = -float(sum(v_counts))/self.N_for_s[s]
-            return [1/self.game.get_action_size() for a in range(self.game.get_action_size())], v
+    def search_root(self, state, count, noise=None):
+        """
+        run count simulations from state
+        noise: vector mixed into the root policy, to tell apart the searches of root-parallel workers
+        Returns:
+            (Node of state, Node of state after a pass), None for nodes not in the tree
+        """
+        self.noise = noise
+        # keep the statistics under the new root as a warm start and drop the rest
+        if self.args.get("reuse_tree", False):
+            self.prune(state)
+
+        # args.time_budget stops the search at a deadline, in seconds per move
+        start = time.perf_counter()
+        time_budget = self.args.get("time_budget")
+        valid_vector = state.get_valid_moves().copy()
+
+        # leaf_batch > 1 evaluates that many leaves with one network call
+        batch = self.args.get("leaf_batch", 1)
+        done = 0
+        # args.gumbel spends count on a few sampled root actions instead of PUCT at the root,
+        # the loop below only runs what it could not spend with the root evicted
+        if self.args.get("gumbel", False) and valid_vector.any():
+            done = self.__search_gumbel(state, count, valid_vector)
+        elif batch > 1 and count > 0:
+            # every descent of a first batch would stop at the root, evaluate it alone first
+            root = self.nodes.peek(state.hash)
+            if root is None or root.policy is None:
+                self.pass_count = 0
+                self.search(state)
+                self.simulations += 1
+                done += 1
+        scaled = False
+        while done < count:
+            k = min(batch, count - done)
+            if batch > 1:
+                self.search_batch(state, k)
+            else:
+                self.pass_count = 0
+                self.search(state)
+            done += k
+            self.simulations += k
+
+            # args.adaptive scales the budget once the root has been evaluated
+            if not scaled and self.args.get("adaptive") is not None:
+                scaled = True
+                count = max(done, self.__scale_budget(state, valid_vector, count))
+
+            remaining = count - done
+            if time_budget is not None:
+                elapsed = time.perf_counter() - start
+                if elapsed >= time_budget:
+                    break
+                # simulations that still fit before the deadline at the rate so far
+                remaining = min(remaining, int(done*(time_budget - elapsed)/elapsed))
+            if self.args.get("early_stop", False) and self.__is_decided(state, valid_vector, remaining):
+                break
+
+        self.noise = None
+        return self.nodes.peek(state.hash), self.nodes.peek(state.flip_hash)
+
+    # the most visited root action can not be overtaken by the remaining simulations
+    def __is_decided(self, state, valid_vector: np.ndarray, remaining: int):
+        root = self.nodes.peek(state.hash)
+        if root is None or root.visits is None:
+            return False
+        visits = root.visits[:-1]
+        if np.count_nonzero(valid_vector) <= 1:
+            # a forced move or a pass, nothing to choose
+            return visits.max() > 0 or not valid_vector.any()
+        best, second = np.partition(visits, -2)[-2:][::-1]
+        return best - second > remaining
+
+    # count scaled down for late positions ("phase") or for a root policy sure of its move ("entropy")
+    def __scale_budget(self, state, valid_vector: np.ndarray, count: int):
+        adaptive = self.args.adaptive
+        if adaptive == "phase":
+            # the more stones on the board, the fewer moves are left to compare
+            filled = np.count_nonzero(state.board)/self.game.get_action_size()
+            return int(count*max(0.25, 1 - filled))
+
+        assert(adaptive == "entropy")
+        root = self.nodes.peek(state.hash)
+        moves = np.count_nonzero(valid_vector)
+        if root is None or root.policy is None or moves <= 1:
+            return count
+        p = root.policy*valid_vector
+        p = p[p > 0]/p.sum() if p.sum() > 0 else np.full(moves, 1/moves)
+        entropy = -float(np.sum(p*np.log(p)))
+        return int(count*(0.25 + 0.75*entropy/math.log(moves)))
+
+    # Gumbel top-k sampling of root actions, then sequential halving of count among them
+    # return: simulations run, count unless the root got evicted
+    def __search_gumbel(self, state, count: int, valid_vector: np.ndarray):
+        done = 0
+        if count <= 0:
+            return done
+        root = self.nodes.peek(state.hash)
+        if root is None or root.policy is None:
+            self.pass_count = 0
+            self.search(state)
+            self.simulations += 1
+            done += 1
+            root = self.nodes.peek(state.hash)
+            # evicted already, only with a max_nodes smaller than one search path
+            if root is None or root.policy is None:
+                return done
+        root.expand(self.game.get_action_size())
+
+        # adding Gumbel noise to the logits and taking the top m samples m actions without replacement
+        logits = self.__logits(root, valid_vector)
+        gumbel = np.random.gumbel(size=len(logits))
+        moves = np.count_nonzero(valid_vector)
+        m = min(self.args.get("gumbel_actions", 16), moves, max(1, count))
+        actions = np.argsort(-(gumbel + logits))[:m]
+
+        phases = max(1, math.ceil(math.log2(m)))
+        for i in range(phases):
+            # every action left gets the same share of the simulations left for the phases
+            # still ahead, the last phase spends all of them, the better actions first
+            left = count - done if i == phases - 1 else (count - done)//(phases - i)
+            for j, a in enumerate(actions):
+                k = min(max(1, left//len(actions) + (j < left % len(actions))), count - done)
+                if k <= 0:
+                    break
+                self.__search_action(state, int(a), k)
+                done += k
+            if i == phases - 1:
+                break
+            # keep the better half by the same score, now with the searched Q
+            root = self.nodes.peek(state.hash)
+            if root is None:
+                return done
+            score = gumbel[actions] + logits[actions] + self.__sigma(root, root.get_q()[actions])
+            actions = actions[np.argsort(-score)[:math.ceil(len(actions)/2)]]
+        assert(done == count)
+        return done
+
+    # run k simulations that all take root action a
+    def __search_action(self, state, a: int, k: int):
+        self.root_action = a
+        batch = self.args.get("leaf_batch", 1)
+        done = 0
+        while done < k:
+            j = min(batch, k - done)
+            if batch > 1:
+                self.search_batch(state, j)
+            else:
+                self.pass_count = 0
+                self.search(state)
+            done += j
+        self.simulations += k
+        self.root_action = None
+
+    # log of the root policy over valid moves, -inf elsewhere
+    def __logits(self, node: "Node", valid_vector: np.ndarray):
+        with np.errstate(divide="ignore"):
+            logits = np.log(np.asarray(node.policy, dtype=np.float64)*valid_vector)
+        logits[valid_vector == 0] = -np.inf
+        # moves the network gives no probability at all are still possible
+        logits[(valid_vector != 0) & np.isneginf(logits)] = -30
+        return logits
+
+    # monotone transform of Q that grows with the visits of the most visited action
+    def __sigma(self, node: "Node", q: np.ndarray):
+        c_visit = self.args.get("c_visit", 50)
+        c_scale = self.args.get("c_scale", 1.0)
+        return (c_visit + node.visits[:-1].max())*c_scale*q
+
+    # softmax(logits + sigma(completed Q)), Q of unvisited actions replaced by the policy weighted Q of the visited ones
+    def __improved_policy(self, node: "Node", valid_vector: np.ndarray):
+        logits = self.__logits(node, valid_vector)
+        visits = node.visits[:-1]
+        q = node.get_q()[:-1]
+        visited = (visits > 0) & (valid_vector != 0)
+        if visited.any():
+            prior = np.exp(logits[visited] - logits[visited].max())
+            v_mix = float(np.sum(prior*q[visited])/np.sum(prior))
         else:
-            p = [x/p_sum for x in p_counts]
-            v_counts = [self.Q_for_s_a[(s, a)]*self.N_for_s_a[(s, a)] if (
-                s, a) in self.Q_for_s_a else 0 for a in range(self.game.get_action_size())]
-            v = float(sum(v_counts))/self.N_for_s[s]
-            return p, v
+            v_mix = 0.0
+        scores = logits + self.__sigma(node, np.where(visited, q, v_mix))
+        if not np.isfinite(scores).any():
+            return np.full(len(scores), 1/len(scores))
+        policy = np.exp(scores - scores[np.isfinite(scores)].max())
+        return policy/policy.sum()
+
+    def close(self):
+        """
+        stop the worker processes of root-parallel search
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
 
-    def search(self, board, depth=0, exhaust=False):
+    def prune(self, state):
         """
-        Run dfs to leaf node. Use U = maximum upper confidence bound.
+        Keep only the nodes reached from state by visited edges, the subtree of the
+        moves just played, and forget every other board.
+        state: GameState of the new root, back at it when this returns
+        """
+        node = self.nodes.peek(state.hash)
+        if node is None:
+            self.nodes.retain(())
+            return
+
+        kept = {state.hash: node}
+        stack = [self.__children(node)]
+        while len(stack) > 0:
+            a = next(stack[-1], None)
+            if a is None:
+                stack.pop()
+                if len(stack) > 0:
+                    state.undo()
+                continue
+
+            state.play(a)
+            node = self.nodes.peek(state.hash)
+            if node is None or state.hash in kept:
+                state.undo()
+                continue
+            kept[state.hash] = node
+            stack.append(self.__children(node))
+        self.nodes.retain(kept)
+
+    def search(self, state, exhaust=False):
+        """
+        Walk down to a leaf node. Use U = maximum upper confidence bound.
         Once a leaf node is found, the neural network is called to return an
         initial policy P and a value v for the state. This value is propagated
-        up the search path.
+        back up the search path in a loop, one ply at a time.
+        state: GameState of the standard board, moves are played on it and undone
+               on the way back so the descent copies no board
         Returns:
             v: the negative of the value of the current board
         """
+        # every lap charges the time since the previous one to a phase
+        stats = self.stats
+        if stats is not None:
+            stats.lap()
+
+        action_size = self.game.get_action_size()
+        depth = 0
+        while True:
+            s = state.hash
+            node = self.nodes.get(s)
+            if node is None:
+                node = self.nodes.put(s, Node(state.check_is_end()))
+
+            if node.end != 0 or depth > action_size or self.pass_count >= 2:
+                v = -state.get_win_lose()
+                if stats is not None:
+                    stats.lap("rules")
+                break
+
+            if stats is not None:
+                stats.lap("rules")
+            if node.policy is None:
+                node.policy, v = self.__predict(state.board)
+                if stats is not None:
+                    stats.lap("nn")
+                if exhaust == False:
+                    v = -v
+                    break
+
+            node.expand(action_size)
+
+            # moves repeating a board on the path are already not valid
+            valid_vector = state.get_valid_moves()
+            if stats is not None:
+                stats.lap("rules")
+            if depth == 0 and self.root_action is not None:
+                a = self.root_action
+            else:
+                a = self.__select(node, valid_vector, self.noise if depth == 0 else None)
+            if stats is not None:
+                stats.lap("select")
 
-        s = self.game.to_string(board)
+            if a != -1:
+                self.pass_count = 0
+            else:
+                self.pass_count += 1
+
+            self.path_nodes[depth] = node
+            self.path_actions[depth] = a
+            state.play(a)
+            depth += 1
+
+        # every ply backs up the negative of the value of the ply below
+        for i in range(depth - 1, -1, -1):
+            state.undo()
+            self.path_nodes[i].backup(self.path_actions[i], v)
+            v = -v
+
+        if stats is not None:
+            stats.lap("backup")
+            stats.simulations += 1
+            stats.depth += depth
+        return v
+
+    def search_batch(self, state, k):
+        """
+        Run k descents like search, putting a virtual loss on every edge taken so the
+        next descents spread out, then evaluate all their new leaves with one batched
+        network call and back every descent up.
+        state: GameState of the standard board, back at the root when this returns
+        """
+        stats = self.stats
+        if stats is not None:
+            stats.lap()
+
+        # new leaves waiting for the network, hash -> (node, board)
+        pending = {}
+        descents = [self.__descend(state, pending) for _ in range(k)]
+
+        values = {}
+        if len(pending) > 0:
+            leaves = list(pending.values())
+            policies, vs = self.__predict_batch(np.array([board for _, board in leaves]))
+            for s, (node, _), policy, v in zip(pending, leaves, policies, vs):
+                node.policy = policy
+                values[s] = -v
+            if stats is not None:
+                stats.lap("nn")
+
+        virtual_loss = self.args.get("virtual_loss", 1)
+        for path, leaf, v in descents:
+            if leaf is not None:
+                v = values[leaf]
+            for node, a in reversed(path):
+                node.visits[a] -= 1
+                node.value_sum[a] += virtual_loss
+                node.n -= 1
+                node.backup(a, v)
+                v = -v
+
+        if stats is not None:
+            stats.lap("backup")
+            stats.simulations += k
+            stats.depth += sum(len(path) for path, _, _ in descents)
+
+    # walk down to a leaf like search, with a virtual loss on the way
+    # return: (path of (node, action), hash of a leaf left for the network or None, value)
+    def __descend(self, state, pending: dict):
+        virtual_loss = self.args.get("virtual_loss", 1)
+        path = []
+        leaf = None
+        v = None
+        self.pass_count = 0
+        while True:
+            s = state.hash
+            node = self.nodes.get(s)
+            if node is None:
+                node = self.nodes.put(s, Node(state.check_is_end()))
+
+            if node.end != 0 or len(path) > self.game.get_action_size() or self.pass_count >= 2:
+                v = -state.get_win_lose()
+                break
+
+            if node.policy is None:
+                if s not in pending:
+                    pending[s] = (node, state.board)
+                leaf = s
+                break
+
+            node.expand(self.game.get_action_size())
+            valid_vector = state.get_valid_moves()
+            if self.stats is not None:
+                self.stats.lap("rules")
+            if len(path) == 0 and self.root_action is not None:
+                a = self.root_action
+            else:
+                a = self.__select(node, valid_vector, self.noise if len(path) == 0 else None)
+            if self.stats is not None:
+                self.stats.lap("select")
 
-        if s not in self.N_for_s:
-            self.N_for_s[s] = 0
+            if a != -1:
+                self.pass_count = 0
+            else:
+                self.pass_count += 1
+
+            node.visits[a] += 1
+            node.value_sum[a] -= virtual_loss
+            node.n += 1
+            path.append((node, a))
+            state.play(a)
+
+        for _ in path:
+            state.undo()
+        if self.stats is not None:
+            self.stats.lap("rules")
+        return path, leaf, v
+
+    # policy and value of one board, from MCTS.eval_cache when args.eval_cache is set
+    def __predict(self, board: np.ndarray):
+        if self.args.get("eval_cache", False):
+            policies, values = MCTS.eval_cache.predict_batch(self.nnet, board[np.newaxis], self.__evaluate)
+            return policies[0], values[0]
+        self.nn_calls += 1
+        self.nn_leaves += 1
+        policy, v = self.nnet.predict(board)
+        return policy, v[0]
+
+    # policies and values of boards, from MCTS.eval_cache when args.eval_cache is set
+    def __predict_batch(self, boards: np.ndarray):
+        if self.args.get("eval_cache", False):
+            return MCTS.eval_cache.predict_batch(self.nnet, boards, self.__evaluate)
+        return self.__evaluate(boards)
+
+    # policies and values of boards, with one call when the network can take a batch
+    def __evaluate(self, boards: np.ndarray):
+        self.nn_calls += 1
+        self.nn_leaves += len(boards)
+        if hasattr(self.nnet, "predict_batch"):
+            return self.nnet.predict_batch(boards)
+        results = [self.nnet.predict(board) for board in boards]
+        self.nn_calls += len(boards) - 1
+        return [p for p, _ in results], [v[0] for _, v in results]
+
+    # split the simulations over the workers and add up their root statistics
+    def __search_parallel(self, board: np.ndarray, history: "History", count: int):
+        workers = self.args.workers
+        if self.pool is None:
+            # spawn, a forked worker can not use the CUDA context of its parent
+            worker_args = dotdict(self.args)
+            worker_args["workers"] = 1
+            # the parent times the whole parallel search, workers keep no SearchStats
+            worker_args["instrument"] = False
+            self.pool = multiprocessing.get_context("spawn").Pool(
+                workers, initializer=_init_worker, initargs=(self.game, self.nnet, worker_args))
+
+        seeds = np.random.randint(2**31, size=workers)
+        tasks = [(board, history, count//workers + (i < count % workers), seed)
+                 for i, seed in enumerate(seeds)]
+        merged = [None, None]
+        for stats in self.pool.map(_search_worker, tasks):
+            nn_calls, nn_leaves, simulations = stats[0]
+            self.nn_calls += nn_calls
+            self.nn_leaves += nn_leaves
+            self.simulations += simulations
+            if self.stats is not None:
+                self.stats.simulations += simulations
+            for i, node in enumerate(stats[1:]):
+                if node is None or node.visits is None:
+                    continue
+                if merged[i] is None:
+                    merged[i] = Node(node.end)
+                    merged[i].policy = node.policy
+                    merged[i].expand(self.game.get_action_size())
+                merged[i].visits += node.visits
+                merged[i].value_sum += node.value_sum
+                merged[i].n += node.n
+        return merged
+
+    # the actions of every visited edge of node, passing last
+    def __children(self, node: "Node"):
+        if node.visits is None:
+            return iter(())
+        actions = np.flatnonzero(node.visits[:-1]).tolist()
+        if node.visits[-1] > 0:
+            actions.append(-1)
+        return iter(actions)
+
+    # the valid action with the highest upper confidence bound, -1 if there is none
+    def __select(self, node: "Node", valid_vector: np.ndarray, noise: np.ndarray = None):
+        if not valid_vector.any():
+            return -1
+
+        policy = node.policy
+        if noise is not None:
+            epsilon = self.args.get("root_noise", 0.25)
+            policy = (1 - epsilon)*policy + epsilon*noise
+        curr_policy = self.__mask_policy(policy, valid_vector)
+        p_sum = np.sum(curr_policy)
+        if p_sum > 0:
+            curr_policy /= p_sum
 
-        if s not in self.ends:
-            self.ends[s] = self.game.check_is_end(board, 1)
+        visits = node.visits[:-1]
+        # edges never visited have no Q yet and see one more visit of the board
+        exploration = np.where(visits > 0, math.sqrt(node.n), math.sqrt(node.n + 1))/(1 + visits)
+        ucb = node.get_q()[:-1] + self.args.cpuct*curr_policy*exploration
+        ucb[valid_vector == 0] = -np.inf
+        return int(np.argmax(ucb))
 
-        if self.ends[s] != 0 or depth > self.game.get_action_size() or self.pass_count >= 2:
-            return -self.game.get_current_win_lose(board, 1)
+    # policy*valid_vector written into one reused buffer, only read before the next move
+    def __mask_policy(self, policy: np.ndarray, valid_vector: np.ndarray):
+        dtype = np.result_type(policy, valid_vector)
+        if self.masked is None or self.masked.dtype != dtype or self.masked.shape != policy.shape:
+            self.masked = np.empty(policy.shape, dtype=dtype)
+        return np.multiply(policy, valid_vector, out=self.masked)
 
-        valid_vector = self.game.get_valid_moves(board, 1)
-        for a_position, _ in np.ndenumerate(valid_vector):
-            if (s, a_position[0]) in self.latest_two_s_a:
-                valid_vector[a_position] = 0
 
-        if s not in self.policy:
-            self.policy[s], v = self.nnet.predict(board)
-            if exhaust == False:
-                return -v[0]
+# evaluations of args.eval_cache, shared by every MCTS of the process
+MCTS.eval_cache = EvalCache(100000)
 
-        curr_policy = self.policy[s]*valid_vector
-        p_sum = np.sum(curr_policy)
-        if p_sum > 0:
-            curr_policy /= p_sum
 
-        best_UCB = -float('inf')
-        best_action = -1
-
-        # pick the action with the highest upper confidence bound
-        for a in range(self.game.get_action_size()):
-            if valid_vector[a]:
-                if (s, a) in self.Q_for_s_a:
-                    ucb = self.Q_for_s_a[(s, a)] + self.args.cpuct * \
-                        (curr_policy[a]*math.sqrt(self.N_for_s[s]) /
-                         (1 + self.N_for_s_a[(s, a)]))
-                else:
-                    ucb = self.args.cpuct * \
-                        curr_policy[a]*math.sqrt(self.N_for_s[s] + 1)
-
-                if ucb > best_UCB:
-                    best_UCB = ucb
-                    best_action = a
-
-        a = best_action
-
-        if a != -1:
-            self.latest_two_s_a.append((s, a))
-            if len(self.latest_two_s_a) > 2:
-                self.latest_two_s_a.pop(0)
-            self.pass_count = 0
-        else:
-            self.pass_count += 1
+'''
+<- root-parallel workers, each process keeps one MCTS across moves ->
+'''
 
-        next_board, _ = self.game.get_next_state(
-            board, 1, best_action)
-        next_board = self.game.get_standard_board(
-            next_board, -1)
+_worker_mcts = None
 
-        v = self.search(next_board, depth + 1)
 
-        if (s, a) in self.Q_for_s_a:
-            self.Q_for_s_a[(s, a)] = (self.N_for_s_a[(s, a)] *
-                                      self.Q_for_s_a[(s, a)] + v)/(self.N_for_s_a[(s, a)] + 1)
+def _init_worker(game, nnet, args):
+    global _worker_mcts
+    _worker_mcts = MCTS(game, nnet, args)
 
-            self.N_for_s_a[(s, a)] += 1
-        else:
-            self.Q_for_s_a[(s, a)] = v
-            self.N_for_s_a[(s, a)] = 1
 
-        self.N_for_s[s] += 1
-        return -v
+# search one root with its own noise, return (network calls, leaves, simulations), root Node, passed Node
+def _search_worker(task):
+    board, history, count, seed = task
+    mcts = _worker_mcts
+    calls, leaves, simulations = mcts.nn_calls, mcts.nn_leaves, mcts.simulations
+    alpha = mcts.args.get("dirichlet_alpha", 0.3)
+    noise = np.random.RandomState(seed).dirichlet([alpha] * mcts.game.get_action_size())
+    mcts.history = history
+    root, flipped = mcts.search_root(mcts.game.get_state(board, history), count, noise)
+    return (mcts.nn_calls - calls, mcts.nn_leaves - leaves, mcts.simulations - simulations), root, flipped
@@ -1,71 +1,141 @@
 
+from game import History
 import numpy as np
 import time
 
 
+class Resignation():
+    """
+    A side resigns once its value stayed below threshold for moves of its own moves
+    in a row. A playout share of the games is played to the end anyway, to count
+    the resignations that would have been wrong.
+    """
+
+    def __init__(self, threshold=-0.9, moves=3, playout=0.1):
+        self.threshold = threshold
+        self.moves = moves
+        self.playout = playout
+        # games resigned, games played out past a resignation and how many of those were not lost
+        self.resigned = 0
+        self.played_out = 0
+        self.false_resigned = 0
+        self.new_game()
+
+    def new_game(self):
+        # moves in a row each side has been below threshold
+        self.low = {1: 0, -1: 0}
+        self.check = self.threshold is not None and np.random.random_sample() < self.playout
+        # side that would have resigned in a game played out, None if no side did
+        self.would_resign = None
+
+    def resigns(self, side: int, v: float):
+        """
+        v: value of the position for side, to move now
+        Returns:
+            True if side resigns
+        """
+        if self.threshold is None:
+            return False
+        self.low[side] = self.low[side] + 1 if v < self.threshold else 0
+        if self.low[side] < self.moves:
+            return False
+        if self.check:
+            if self.would_resign is None:
+                self.would_resign = side
+            return False
+        self.resigned += 1
+        return True
+
+    def end_game(self, side: int, r: float):
+        """
+        r: result of the finished game for side
+        """
+        if self.would_resign is None:
+            return
+        self.played_out += 1
+        # the side that wanted to resign did not lose
+        if (r if side == self.would_resign else -r) != -1:
+            self.false_resigned += 1
+
+    def false_rate(self):
+        """
+        Returns:
+            share of the played out resignations that were not lost
+        """
+        return self.false_resigned/self.played_out if self.played_out > 0 else 0.0
+
+
 class BattleGround():
-    def __init__(self, player1, player2, game, display=None):
+    def __init__(self, player1, player2, game, display=None, resignation=None):
 
         self.player1 = player1
         self.player2 = player2
         self.game = game
         self.display = display
+        # Resignation of both players from the values they return, None to always play to the end
+        self.resignation = resignation
 
     def playGame(self, verbose=False):
         """
         Returns: (1,or -1, or 0) for player1 win, lose, draw
         """
-        # to avoid kos
-        latest_two_s_a = []
+        # boards seen so far, for positional superko
+        history = History()
         pass_count = 0
+        resignation = self.resignation
+        if resignation is not None:
+            resignation.new_game()
 
         players = [None, self.player1, self.player2]
         curr_player = 1
         board = self.game.get_init_board()
+        position = self.game.get_position(board, curr_player)
         it = 0
-        while self.game.check_is_end(board, curr_player) == 0:
+        while position.end == 0:
             it += 1
             if it > self.game.get_action_size()*2 or pass_count >= 2:
-                return self.game.get_current_win_lose(board, 1)
+                r = self.game.get_current_win_lose(board, 1)
+                if resignation is not None:
+                    resignation.end_game(1, r)
+                return r
             if verbose:
                 assert(self.display)
                 print("Turn ", str(it), "Player ", str(curr_player))
                 self.display(board)
 
-            standard_b = self.game.get_standard_board(board, curr_player)
-            s = self.game.to_string(standard_b)
-            policy, _ = players[curr_player](standard_b)
+            # position is always seen from curr_player
+            standard_b = position.board
+            history.push(position.hash, position.flip_hash)
+            policy, v = players[curr_player](standard_b)
+            if resignation is not None and resignation.resigns(curr_player, v):
+                return -curr_player
 
-            # filter out ko actions
-            valid_vector = self.game.get_valid_moves(standard_b, 1)
-            for a_position, _ in np.ndenumerate(valid_vector):
-                if (s, a_position[0]) in latest_two_s_a:
-                    valid_vector[a_position] = 0
-            policy *= valid_vector
+            # moves repeating an earlier board are already filtered out
+            policy *= position.valid_moves[1]
 
             # must be movable
             if policy.sum() == 0:
                 pass_count += 1
-                board, curr_player = self.game.get_next_state(
-                    board, curr_player, -1)
-                continue
+                action = -1
             else:
                 action = np.argmax(policy)
 
-            # record recent s to a
-            latest_two_s_a.append((s, action))
-            if len(latest_two_s_a) > 2:
-                latest_two_s_a.pop(0)
-
-            board, curr_player = self.game.get_next_state(
-                board, curr_player, action)
+            # one rules call gives the next board with its valid moves and end
+            position = self.game.get_next_position(
+                standard_b, 1, action, history).standard()
+            history.turn()
+            curr_player = -curr_player
+            board = self.game.get_standard_board(position.board, curr_player)
 
         if verbose:
             assert(self.display)
             print("Game over: Turn ", str(it), "Result ",
                   str(self.game.check_is_end(board, 1)))
             self.display(board)
-        return self.game.check_is_end(board, 1)
+        r = self.game.check_is_end(board, 1)
+        if resignation is not None:
+            resignation.end_game(1, r)
+        return r
 
     def playGames(self, num, verbose=False):
         """
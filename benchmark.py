@@ -0,0 +1,153 @@
+from game import Game
+import numpy as np
+import sys
+import time
+
+
+def random_positions(game: "Game", num_games=10):
+    """
+    Returns:
+        (board, player, action) for every move of num_games random games
+    """
+    positions = []
+    for _ in range(num_games):
+        board = game.get_init_board()
+        player = 1
+        for _ in range(game.get_action_size()*2):
+            valids = np.flatnonzero(game.get_valid_moves(board, player))
+            if len(valids) == 0:
+                break
+            action = np.random.choice(valids)
+            positions.append((board, player, action))
+            board, player = game.get_next_state(board, player, action)
+    return positions
+
+
+def benchmark_backends(n, backends=("array", "bitboard")):
+    print("Benchmark rules backends on {}X{}:".format(n, n))
+    positions = random_positions(Game(n))
+    results = {}
+    for backend in backends:
+        game = Game(n, backend)
+        start = time.perf_counter()
+        results[backend] = [(game.get_valid_moves(b, p), game.get_next_state(b, p, a)[0], game.check_is_end(b, p))
+                            for b, p, a in positions]
+        per_move = (time.perf_counter() - start)/len(positions)*1e6
+        print("--> {}: {:.1f} us/position".format(backend, per_move))
+
+    # every backend has to agree with the first one
+    expected = results[backends[0]]
+    for backend in backends[1:]:
+        for (valids, next_board, end), (e_valids, e_next_board, e_end) in zip(results[backend], expected):
+            assert((valids == e_valids).all())
+            assert((next_board == e_next_board).all())
+            assert(end == e_end)
+
+
+def benchmark_position(n, backend="bitboard"):
+    print("Benchmark one search step on {}X{} ({}):".format(n, n, backend))
+    game = Game(n, backend)
+    positions = random_positions(game)
+
+    start = time.perf_counter()
+    for b, p, a in positions:
+        next_board, next_player = game.get_next_state(b, p, a)
+        game.check_is_end(next_board, next_player)
+        game.get_valid_moves(next_board, next_player)
+        game.get_hash(next_board, next_player)
+        game.get_hash(next_board, -next_player)
+    per_move = (time.perf_counter() - start)/len(positions)*1e6
+    print("--> separate calls and hashes: {:.1f} us/position".format(per_move))
+
+    start = time.perf_counter()
+    for b, p, a in positions:
+        game.get_next_position(b, p, a)
+    per_move = (time.perf_counter() - start)/len(positions)*1e6
+    print("--> get_next_position: {:.1f} us/position".format(per_move))
+
+
+def benchmark_batch(n):
+    print("Benchmark batched rules on {}X{}:".format(n, n))
+    game = Game(n, "bitboard")
+    positions = random_positions(game)
+    boards = np.array([b for b, _, _ in positions])
+    players = np.array([p for _, p, _ in positions])
+    actions = np.array([a for _, _, a in positions])
+
+    start = time.perf_counter()
+    valids = game.get_valid_moves_batch(boards, players)
+    next_boards, _ = game.get_next_state_batch(boards, players, actions)
+    ends = game.check_is_end_batch(boards, players)
+    per_move = (time.perf_counter() - start)/len(positions)*1e6
+    print("--> batch of {}: {:.1f} us/position".format(len(positions), per_move))
+
+    for i, (b, p, a) in enumerate(positions):
+        assert((valids[i] == game.get_valid_moves(b, p)).all())
+        assert((next_boards[i] == game.get_next_state(b, p, a)[0]).all())
+        assert(ends[i] == game.check_is_end(b, p))
+
+
+def benchmark_score(n):
+    print("Benchmark area scoring on {}X{}:".format(n, n))
+    game = Game(n)
+    boards = np.array([b for b, _, _ in random_positions(game)])
+
+    start = time.perf_counter()
+    scores = [game.get_current_win_lose(b, 1) for b in boards]
+    per_move = (time.perf_counter() - start)/len(boards)*1e6
+    print("--> one board at a time: {:.1f} us/position".format(per_move))
+
+    start = time.perf_counter()
+    batch_scores = game.get_current_win_lose_batch(boards, np.ones(len(boards)))
+    per_move = (time.perf_counter() - start)/len(boards)*1e6
+    print("--> batch of {}: {:.1f} us/position".format(len(boards), per_move))
+
+    assert((np.array(scores) == batch_scores).all())
+
+
+def benchmark_predict(n, device="cpu", threads=None, repeat=100):
+    # torch is only needed here, the rules benchmarks run without it
+    from model import Model
+    print("Benchmark network predict on {}X{} ({}):".format(n, n, device))
+    game = Game(n)
+    model = Model(game, device, threads)
+    boards = np.array([b for b, _, _ in random_positions(game, 1)])
+
+    # first calls allocate and tune, leave them out
+    for board in boards[:5]:
+        model.predict(board)
+    start = time.perf_counter()
+    for i in range(repeat):
+        model.predict(boards[i % len(boards)])
+    per_call = (time.perf_counter() - start)/repeat*1e3
+    print("--> predict: {:.2f} ms/board".format(per_call))
+
+    for batch in (8, 64):
+        batch_boards = np.resize(boards, (batch,) + boards.shape[1:])
+        model.predict_batch(batch_boards)
+        start = time.perf_counter()
+        for _ in range(max(1, repeat*8//batch)):
+            model.predict_batch(batch_boards)
+        per_board = (time.perf_counter() - start)/(max(1, repeat*8//batch)*batch)*1e3
+        print("--> predict_batch of {}: {:.2f} ms/board".format(batch, per_board))
+
+
+if __name__ == "__main__":
+    # py ./benchmark.py predict [device] times the network instead of the rules
+    if len(sys.argv) > 1 and sys.argv[1] == "predict":
+        device = sys.argv[2] if len(sys.argv) > 2 else "cpu"
+        print("-- Going to benchmark network predict on random boards\n")
+        for n in range(4, 9):
+            benchmark_predict(n, device)
+        sys.exit()
+
+    print("-- Going to benchmark the rules engine on random games")
+    print("-- Every position runs get_valid_moves, get_next_state and check_is_end\n")
+    # time the rules themselves, not Game.cache
+    Game.cache.resize(0)
+    for n in range(4, 9):
+        benchmark_backends(n)
+        benchmark_position(n, "array")
+        benchmark_position(n, "bitboard")
+        benchmark_batch(n)
+        benchmark_score(n)
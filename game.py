@@ -1,4 +1,5 @@
-from game_logic import Board, Groups, Group
+from game_logic import Board, BitBoard, BatchBoard, Geometry, Zobrist, Groups, Group, get_area_score
+from collections import OrderedDict
 import numpy as np
 
 WHITE = 1
@@ -13,8 +14,21 @@ class Game():
         +1: "O"
     }
 
-    def __init__(self, n: int):
+    # rules engines the game can run on, they give identical results
+    backends = {
+        "array": Board,
+        "bitboard": BitBoard
+    }
+
+    # rules queries of standard boards, shared by every Game of the process
+    cache = None
+
+    def __init__(self, n: int, backend: str = "array"):
         self.n = n
+        self.backend = Game.backends[backend]
+        self.batch = BatchBoard(n, n)
+        self.zobrist = Zobrist.get(n, n)
+        self.geometry = Geometry.get(n, n)
 
     def get_init_board(self):
         """
@@ -47,20 +61,65 @@ class Game():
         if action == -1:
             return (board, -player)
 
-        b = Board(self.n, self.n)
-        b.board = np.copy(board)
+        b = self.backend(self.n, self.n)
+        b.board = board
         move = (int(action/self.n), action % self.n)
         b.add_stone(move, player)
         return b.board, -player
 
-    def get_valid_moves(self, board: np.ndarray, player: int):
+    def get_position(self, board: np.ndarray, player: int, history: "History" = None):
+        """
+        history: earlier boards of the game seen from the side of board,
+                 only used to filter the valid moves of player
+        Returns:
+            Position of board with player to move, everything computed from one rules board
+        """
+        b = self.backend(self.n, self.n)
+        b.board = board
+        return Position(b, player, history)
+
+    def get_next_position(self, board: np.ndarray, player: int, action: int, history: "History" = None):
+        """
+        history: earlier boards of the game seen from the side of board, including board
+        Returns:
+            Position after player plays action (-1 to pass), with -player to move
+        the rules board is built from board for this call, like every query of Game, so
+        nothing is kept from move to move; GameState keeps one board alive for the search
+        """
+        b = self.backend(self.n, self.n)
+        b.board = board
+        if action != -1:
+            b.add_stone((int(action/self.n), action % self.n), player)
+        return Position(b, -player, history)
+
+    def get_state(self, board: np.ndarray, history: "History" = None):
+        """
+        history: earlier boards of the game seen from the side of board, GameState keeps it up to date
+        Returns:
+            GameState of board with player 1 to move, to play and undo moves in place
+        """
+        return GameState(self, board, history)
+
+    def get_valid_moves(self, board: np.ndarray, player: int, history: "History" = None):
         """
+        history: earlier boards of the game seen from the side of board,
+                 moves that repeat one of them are not valid (positional superko)
         Returns:
-            valid move vector
+            valid move vector, a new array with or without history
         """
-        b = Board(self.n, self.n)
-        b.board = np.copy(board)
-        return b.get_valid_moves(player).ravel()
+        if history is not None:
+            b = self.backend(self.n, self.n)
+            b.board = board
+            return b.get_valid_moves(player, history).ravel()
+
+        def valid_moves():
+            b = self.backend(self.n, self.n)
+            b.board = player*board
+            valids = b.get_valid_moves(1).ravel()
+            valids.flags.writeable = False
+            return valids
+        # the cached vector is shared and read-only, callers may mask their own copy in place
+        return Game.cache.get(("moves", self.n, self.get_hash(board, player)), valid_moves).copy()
 
     def check_is_end(self, board: np.ndarray, player: int):
         """
@@ -69,37 +128,67 @@ class Game():
                small non-zero value for draw.
 
         """
-        b = Board(self.n, self.n)
-        b.board = np.copy(board)
+        def is_end():
+            b = self.backend(self.n, self.n)
+            b.board = player*board
+            if b.get_valid_moves(1).ravel().sum() == 0 and b.get_valid_moves(-1).ravel().sum() == 0:
+                return self.get_current_win_lose(board, player)
+            else:
+                return 0
+        return Game.cache.get(("end", self.n, self.get_hash(board, player)), is_end)
+
+    def get_current_win_lose(self, board: np.ndarray, player: int):
+        """
+        Returns:
+            r: 0 if game has not ended. 1 if player won, -1 if player lost,
+               small non-zero value for draw.
 
-        if b.get_valid_moves(player).ravel().sum() == 0 and b.get_valid_moves(-player).ravel().sum() == 0:
-            score = b.get_score()
+        """
+        def win_lose():
+            score = get_area_score(board)
             if score[player] > score[-player]:
                 return 1
             elif score[player] < score[-player]:
                 return -1
             else:
                 return 1e-12
-        else:
-            return 0
+        return Game.cache.get(("win_lose", self.n, self.get_hash(board, player)), win_lose)
 
-    def get_current_win_lose(self, board: np.ndarray, player: int):
+    '''
+    <- batched rules, boards have shape (N, n, n) and player is one value or one per board ->
+    '''
+
+    def get_next_state_batch(self, boards: np.ndarray, player, actions: np.ndarray):
         """
         Returns:
-            r: 0 if game has not ended. 1 if player won, -1 if player lost,
-               small non-zero value for draw.
+            nextBoards: boards after applying one action each, -1 to pass
+            nextPlayer: -player
+        """
+        return self.batch.add_stones(boards, actions, player), -np.asarray(player)
+
+    def get_valid_moves_batch(self, boards: np.ndarray, player):
+        """
+        Returns:
+            valid move vectors, shape (N, action_size)
+        """
+        return self.batch.get_valid_moves(boards, player).reshape(len(boards), -1)
 
+    def check_is_end_batch(self, boards: np.ndarray, player):
+        """
+        Returns:
+            r: check_is_end for every board, shape (N,)
         """
-        b = Board(self.n, self.n)
-        b.board = np.copy(board)
+        ended = self.batch.is_end(boards)
+        return np.where(ended, self.get_current_win_lose_batch(boards, player), 0)
 
-        score = b.get_score()
-        if score[player] > score[-player]:
-            return 1
-        elif score[player] < score[-player]:
-            return -1
-        else:
-            return 1e-12
+    def get_current_win_lose_batch(self, boards: np.ndarray, player):
+        """
+        Returns:
+            r: get_current_win_lose for every board, shape (N,)
+        """
+        score = self.batch.get_score(boards)
+        diff = (score[WHITE] - score[BLACK])*np.asarray(player)
+        return np.where(diff > 0, 1, np.where(diff < 0, -1, 1e-12))
 
     def get_standard_board(self, board: np.ndarray, player: int):
         """
@@ -114,26 +203,23 @@ class Game():
             all sides of the board (board, p)
         """
         assert(len(p) == self.n**2)
-        P = np.reshape(p, (self.n, self.n))
-        l = []
-
-        for i in range(4):
-            newRotB = np.rot90(board, i)
-            newRotP = np.rot90(P, i)
-            l += [(newRotB, newRotP.ravel())]
-
-            newSymB = np.fliplr(newRotB)
-            newSymP = np.fliplr(newRotP)
-            l += [(newSymB, newSymP.ravel())]
-
-        return l
+        b = board.ravel()
+        p = np.asarray(p)
+        return [(b[perm].reshape(self.n, self.n), p[perm]) for perm in self.geometry.symmetries]
 
     def to_string(self, board: np.ndarray):
         """
         Returns: 
             board's string marshall
         """
-        return board.tostring()
+        return board.tobytes()
+
+    def get_hash(self, board: np.ndarray, player: int = 1):
+        """
+        Returns:
+            zobrist hash of the standard board of player, used as the key of a state
+        """
+        return self.zobrist.hash(player*board)
 
     @staticmethod
     def display(board):
@@ -150,6 +236,258 @@ class Game():
             print("|")
 
 
+class Position():
+    """
+    A board with the player to move and what the rules say about it: the hashes, the valid
+    moves of both colors, the score and check_is_end / get_current_win_lose for player.
+    """
+
+    def __init__(self, b, player: int, history: "History" = None):
+        self.board = b.board
+        self.player = player
+        self.hash = b.get_hash()
+        self.flip_hash = b.get_flip_hash()
+
+        valid_moves = b.get_all_valid_moves()
+        ended = not valid_moves[WHITE].any() and not valid_moves[BLACK].any()
+        if history is not None:
+            b.remove_repeats(valid_moves[player], player, history)
+        self.valid_moves = {color: moves.ravel() for color, moves in valid_moves.items()}
+
+        self.score = b.get_score()
+        if self.score[player] > self.score[-player]:
+            self.win_lose = 1
+        elif self.score[player] < self.score[-player]:
+            self.win_lose = -1
+        else:
+            self.win_lose = 1e-12
+        self.end = self.win_lose if ended else 0
+
+    def standard(self):
+        """
+        Returns:
+            this position seen from the player to move, as get_standard_board does for boards
+        """
+        if self.player == 1:
+            return self
+        flipped = Position.__new__(Position)
+        flipped.board = -self.board
+        flipped.player = 1
+        flipped.hash = self.flip_hash
+        flipped.flip_hash = self.hash
+        flipped.valid_moves = {WHITE: self.valid_moves[BLACK], BLACK: self.valid_moves[WHITE]}
+        flipped.score = {WHITE: self.score[BLACK], BLACK: self.score[WHITE]}
+        flipped.win_lose = self.win_lose
+        flipped.end = self.end
+        return flipped
+
+
+class GameState():
+    """
+    A game that is played and taken back in place, always seen from the player to move
+    like a standard board. play keeps an undo record (the move, captured stones, prior ko
+    and hashes) instead of copying the board, and turns the board to the other player by
+    swapping the two bitboards instead of negating an array.
+    """
+
+    def __init__(self, game: "Game", board: np.ndarray, history: "History" = None):
+        self.game = game
+        self.n = game.n
+        self.b = BitBoard(game.n, game.n)
+        self.b.board = board
+        self.b.get_hash()
+        self.history = history if history is not None else History()
+        self.records = []
+        # one valid move vector for every depth, reused by every move played to that depth
+        self.valids = []
+
+    @property
+    def board(self):
+        """
+        the standard board as a new array, only needed to show it to the network
+        """
+        return self.b.board
+
+    @property
+    def hash(self):
+        return self.b.hash
+
+    @property
+    def flip_hash(self):
+        return self.b.flip_hash
+
+    @property
+    def depth(self):
+        return len(self.records)
+
+    def play(self, action: int):
+        """
+        play a valid action (-1 to pass) and record the board left behind in history
+        """
+        self.history.push(self.b.hash, self.b.flip_hash)
+        move = None if action == -1 else divmod(int(action), self.n)
+        self.records.append(self.b.play(move, WHITE))
+        self.b.flip()
+        self.history.turn()
+
+    def undo(self):
+        """
+        take back the last play
+        """
+        self.history.turn()
+        self.b.flip()
+        self.b.undo(self.records.pop())
+        self.history.pop(self.b.hash, self.b.flip_hash)
+
+    def get_valid_moves(self):
+        """
+        Returns:
+            valid move vector of the player to move without moves repeating a board in
+            history, it is overwritten by the next call at the same depth
+        """
+        while len(self.valids) <= self.depth:
+            self.valids.append(np.zeros(self.n*self.n, dtype=np.int8))
+        free = 0
+        for move, next_hash in self.__cached("next_hashes", self.__next_hashes):
+            if next_hash not in self.history:
+                free |= move
+        return self.b.fill(free, self.valids[self.depth])
+
+    def get_win_lose(self):
+        """
+        Returns:
+            get_current_win_lose for the player to move
+        """
+        return Game.cache.get(("win_lose", self.n, self.b.hash), self.__win_lose)
+
+    def check_is_end(self):
+        """
+        Returns:
+            check_is_end for the player to move
+        """
+        return self.__cached("end", lambda: self.get_win_lose() if self.b.is_end() else 0)
+
+    # the standard board is the key of Game.cache, unless a ko changes the answer
+    def __cached(self, query: str, compute):
+        if self.b.ko[WHITE] or self.b.ko[BLACK]:
+            return compute()
+        return Game.cache.get((query, self.n, self.b.hash), compute)
+
+    def __next_hashes(self):
+        return self.b.get_next_hashes(self.b.get_valid_mask(WHITE), WHITE)
+
+    def __win_lose(self):
+        score = self.b.get_score()
+        if score[WHITE] > score[BLACK]:
+            return 1
+        elif score[WHITE] < score[BLACK]:
+            return -1
+        else:
+            return 1e-12
+
+
+class RulesCache():
+    """
+    Bounded memo of rules queries, keyed by (query, n, zobrist hash of the standard board).
+    The least recently used entry is evicted once capacity is reached, capacity 0 turns it off.
+    """
+
+    def __init__(self, capacity: int = 20000):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple, compute):
+        """
+        Returns:
+            the cached value of key, computed by compute() on a miss
+        """
+        value = self.entries.get(key)
+        if value is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return value
+
+        self.misses += 1
+        value = compute()
+        if self.capacity > 0:
+            self.entries[key] = value
+            self.resize(self.capacity)
+        return value
+
+    def resize(self, capacity: int):
+        """
+        keep at most capacity entries from now on
+        """
+        self.capacity = capacity
+        while len(self.entries) > capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """
+        Returns:
+            dict of size, capacity, hits, misses, evictions and hit_rate
+        """
+        total = self.hits + self.misses
+        return {"size": len(self.entries), "capacity": self.capacity, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits/total if total > 0 else 0.0}
+
+
+Game.cache = RulesCache()
+
+
+class History():
+    """
+    Hashes of the boards of one game, kept from both players' sides so they can be
+    looked up with the standard board of whoever is to move.
+    """
+
+    def __init__(self):
+        self.seen = [{}, {}]
+        self.side = 0
+
+    def __contains__(self, board_hash: int):
+        return board_hash in self.seen[self.side]
+
+    def copy(self):
+        history = History()
+        history.seen = [dict(self.seen[0]), dict(self.seen[1])]
+        history.side = self.side
+        return history
+
+    def push(self, board_hash: int, flip_hash: int):
+        """
+        record the standard board of the player to move, flip_hash is the hash of its negation
+        """
+        for seen, h in ((self.seen[self.side], board_hash), (self.seen[1 - self.side], flip_hash)):
+            seen[h] = seen.get(h, 0) + 1
+
+    def pop(self, board_hash: int, flip_hash: int):
+        """
+        forget a board recorded by push from the same side
+        """
+        for seen, h in ((self.seen[self.side], board_hash), (self.seen[1 - self.side], flip_hash)):
+            seen[h] -= 1
+            if seen[h] == 0:
+                del seen[h]
+
+    def turn(self):
+        """
+        the other player is to move
+        """
+        self.side = 1 - self.side
+
+
 if __name__ == "__main__":
     print("start testing")
     g = Game(4)
@@ -3,6 +3,212 @@ import numpy as np
 WHITE = 1
 EMPTY = 0
 BLACK = -1
+# points outside the board in padded layouts
+OUTSIDE = 2
+
+
+'''
+<- vectorized eyes and score, on one board (x, y) or a batch of boards (N, x, y) ->
+'''
+
+
+# boards with one line of value all around
+def pad(boards: np.ndarray, value):
+    padded = np.full(boards.shape[:-2] + (boards.shape[-2] + 2, boards.shape[-1] + 2),
+                     value, dtype=boards.dtype)
+    padded[..., 1:-1, 1:-1] = boards
+    return padded
+
+
+# the neighbors of every point as shifted views of padded boards, then the diagonal points
+def shifted(padded: np.ndarray, diagonal=False):
+    views = [padded[..., 1:-1, 2:], padded[..., 2:, 1:-1],
+             padded[..., 1:-1, :-2], padded[..., :-2, 1:-1]]
+    if diagonal:
+        views += [padded[..., 2:, 2:], padded[..., 2:, :-2],
+                  padded[..., :-2, :-2], padded[..., :-2, 2:]]
+    return views
+
+
+# color as a value or one value per board, broadcastable against boards
+def broadcast_color(boards: np.ndarray, color):
+    color = np.asarray(color)
+    return color.reshape(color.shape + (1,) * (boards.ndim - color.ndim))
+
+
+# sum of the colors of the neighbors of every point
+def neighbor_sum(boards: np.ndarray):
+    padded = pad(boards, EMPTY)
+    around = padded[..., 1:-1, 2:] + padded[..., 2:, 1:-1]
+    around += padded[..., 1:-1, :-2]
+    around += padded[..., :-2, 1:-1]
+    return around
+
+
+def get_eyes(boards: np.ndarray, color, around: np.ndarray = None):
+    '''
+    around: neighbor_sum of boards if already known
+    return: empty points whose neighbors inside the board are all color
+    '''
+    if around is None:
+        around = neighbor_sum(boards)
+    # colors are -1, 0, 1 so the sum only reaches color * count when every neighbor is color
+    count = Geometry.get(*boards.shape[-2:]).neighbor_count
+    return (boards == EMPTY) & (around * broadcast_color(boards, color) == count)
+
+
+def get_alive_eyes(boards: np.ndarray, color):
+    '''
+    return: empty points whose neighbors and diagonal points inside the board are all color,
+            or 7 of them when all 8 are inside the board
+    '''
+    other = pad(boards != broadcast_color(boards, color), False)
+    inside = pad(np.ones(boards.shape[-2:], dtype=bool), False)
+    count = sum(view.astype(np.int8) for view in shifted(other, diagonal=True))
+    total = sum(view.astype(np.int8) for view in shifted(inside, diagonal=True))
+    return (boards == EMPTY) & ((count == 0) | ((total == 8) & (count == 1)))
+
+
+def get_area_score(boards: np.ndarray):
+    '''
+    return: {WHITE: score, BLACK: score}, stones plus eyes of each color, one score per board
+    '''
+    around = neighbor_sum(boards)
+    count = Geometry.get(*boards.shape[-2:]).neighbor_count
+    empty = boards == EMPTY
+    # counting over the whole array is much faster than over two axes
+    axis = None if boards.ndim == 2 else (-2, -1)
+    return {color: np.count_nonzero(boards == color, axis=axis) +
+            np.count_nonzero(empty & (around == color * count), axis=axis)
+            for color in (WHITE, BLACK)}
+
+
+class Zobrist:
+    '''
+    A random key for every (color, point), the hash of a board is the xor of the keys of its stones,
+    so putting or removing a stone only xors one key.
+    '''
+
+    # one table per board size, shared by every board of that size
+    tables = {}
+
+    @staticmethod
+    def get(x: int, y: int):
+        if (x, y) not in Zobrist.tables:
+            Zobrist.tables[(x, y)] = Zobrist(x, y)
+        return Zobrist.tables[(x, y)]
+
+    def __init__(self, x: int, y: int):
+        self.y = y
+        # fixed seed so hashes are the same in every process
+        rng = np.random.RandomState(x * 100 + y)
+        self.table = rng.randint(1, 2**63, size=[3, x * y], dtype=np.int64)
+        self.table[EMPTY + 1] = 0
+        self.points = np.arange(x * y)
+        self.keys = {WHITE: self.table[WHITE + 1].tolist(),
+                     BLACK: self.table[BLACK + 1].tolist()}
+
+    def hash(self, board: np.ndarray):
+        return int(np.bitwise_xor.reduce(self.table[board.ravel() + 1, self.points]))
+
+    # hashes of flat boards stacked on the last axis
+    def hash_batch(self, flat: np.ndarray):
+        return np.bitwise_xor.reduce(self.table[flat + 1, self.points], axis=-1)
+
+    def key(self, position: tuple, color: int):
+        return self.keys[color][position[0] * self.y + position[1]]
+
+
+class Geometry:
+    '''
+    Tables about the points of a board size, built once and shared by every board of that size.
+    A position is a tuple (r, c), a point is its index in a padded 1-D layout with one line of
+    OUTSIDE all around the board, so point +/- 1 and point +/- width never leave the layout.
+    '''
+
+    # one geometry per board size, shared by every board of that size
+    tables = {}
+
+    @staticmethod
+    def get(x: int, y: int):
+        if (x, y) not in Geometry.tables:
+            Geometry.tables[(x, y)] = Geometry(x, y)
+        return Geometry.tables[(x, y)]
+
+    def __init__(self, x: int, y: int):
+        self.x = x
+        self.y = y
+        self.size = x * y
+        self.width = y + 2
+
+        # padded point of every position, in action order
+        self.points = [(r + 1) * self.width + c + 1 for r in range(x) for c in range(y)]
+        self.point_array = np.array(self.points)
+        self.index = {(r, c): self.points[r * y + c] for r in range(x) for c in range(y)}
+        self.position = {point: position for position, point in self.index.items()}
+        # action (flat index) of every point, -1 outside the board
+        self.action = [-1] * ((x + 2) * self.width)
+        for action, point in enumerate(self.points):
+            self.action[point] = action
+        # padded layout of an empty board
+        self.empty = [OUTSIDE] * ((x + 2) * self.width)
+        for point in self.points:
+            self.empty[point] = EMPTY
+
+        # points next to every point, only the ones inside the board
+        self.neighbors = {}
+        self.diagonal = {}
+        for point in self.points:
+            self.neighbors[point] = [point + offset for offset in (1, self.width, -1, -self.width)
+                                     if self.empty[point + offset] == EMPTY]
+            self.diagonal[point] = [point + offset for offset in
+                                    (self.width + 1, self.width - 1, -self.width - 1, -self.width + 1)
+                                    if self.empty[point + offset] == EMPTY]
+
+        # number of neighbors inside the board of every position
+        self.neighbor_count = np.array([len(self.neighbors[point]) for point in self.points],
+                                       dtype=np.int8).reshape(x, y)
+
+        # same tables by action for numpy, self.size stands for outside the board
+        self.neighbor_table = np.full([self.size, 4], self.size, dtype=np.intp)
+        self.diagonal_table = np.full([self.size, 4], self.size, dtype=np.intp)
+        for action, point in enumerate(self.points):
+            for k, neighbor in enumerate(self.neighbors[point]):
+                self.neighbor_table[action, k] = self.action[neighbor]
+            for k, neighbor in enumerate(self.diagonal[point]):
+                self.diagonal_table[action, k] = self.action[neighbor]
+
+        # bitboard masks, bit r*y + c is the position (r, c)
+        self.full = (1 << self.size) - 1
+        left = 0
+        right = 0
+        for r in range(x):
+            left |= 1 << (r * y)
+            right |= 1 << (r * y + y - 1)
+        # masks to stop shifted stones from wrapping around to the next row
+        self.not_left = self.full & ~left
+        self.not_right = self.full & ~right
+        # points with all 8 neighbors inside the board
+        self.interior = 0
+        for action, point in enumerate(self.points):
+            if len(self.neighbors[point]) + len(self.diagonal[point]) == 8:
+                self.interior |= 1 << action
+
+        # action permutations of the 8 rotations and reflections, in get_all_perspectives order
+        self.symmetries = []
+        if x == y:
+            actions = np.arange(self.size).reshape(x, y)
+            for i in range(4):
+                rotated = np.rot90(actions, i)
+                self.symmetries += [rotated.ravel(), np.fliplr(rotated).ravel()]
+
+    def to_array(self, flat: list):
+        return np.array(flat, dtype=np.int8)[self.point_array].reshape(self.x, self.y)
+
+    def from_array(self, board: np.ndarray):
+        flat = np.full(len(self.empty), OUTSIDE, dtype=np.int8)
+        flat[self.point_array] = board.ravel()
+        return flat.tolist()
 
 
 class Board:
@@ -10,82 +216,129 @@ class Board:
         self.x = x
         self.y = y
         self.ko = {BLACK: set(), WHITE: set()}
-        self.board = np.zeros([x, y], dtype=np.int8)
-        self.neighbors = {
-            (x, y): list(
-                filter(
-                    self.__is_bound,
-                    [(x, y + 1), (x + 1, y),
-                     (x, y - 1), (x - 1, y)]
-                )
-            ) for x, y in [(i, j) for i in range(x) for j in range(y)]
-        }
-        self.diagonal = {
-            (x, y): list(
-                filter(
-                    self.__is_bound,
-                    [(x + 1, y + 1), (x + 1, y - 1),
-                     (x - 1, y - 1), (x - 1, y + 1)]
-                )
-            ) for x, y in [(i, j) for i in range(x) for j in range(y)]
-        }
+        self.geometry = Geometry.get(x, y)
+        self.neighbors = self.geometry.neighbors
+        self.diagonal = self.geometry.diagonal
+        # stones on the padded layout of the geometry
+        self.flat = list(self.geometry.empty)
+        # groups are built lazily from the stones and then kept up to date
+        # incrementally by add_stone, which only pays off on a Board kept alive across
+        # moves: a Board made for one query (as Game does) floods the board once anyway
+        self.groups = None
+        # same for the zobrist hash of the stones and of the stones with colors flipped
+        self.zobrist = Zobrist.get(x, y)
+        self.hash = None
+        self.flip_hash = None
+
+    @property
+    def board(self):
+        return self.geometry.to_array(self.flat)
+
+    # replacing the stones invalidates the tracked groups and hash
+    @board.setter
+    def board(self, board: np.ndarray):
+        self.flat = self.geometry.from_array(board)
+        self.groups = None
+        self.hash = None
+        self.flip_hash = None
+
+    def get_groups(self):
+        '''
+        return: groups of current board, built once and then updated by add_stone
+        '''
+        if self.groups is None:
+            self.groups = Groups(self)
+            self.groups.build()
+        return self.groups
+
+    def get_hash(self):
+        '''
+        return: zobrist hash of current board, computed once and then updated by add_stone
+        '''
+        if self.hash is None:
+            board = self.board
+            self.hash = self.zobrist.hash(board)
+            self.flip_hash = self.zobrist.hash(-board)
+        return self.hash
+
+    def get_flip_hash(self):
+        '''
+        return: zobrist hash of current board with colors flipped
+        '''
+        self.get_hash()
+        return self.flip_hash
+
+    def get_next_hash(self, position: tuple, color: int):
+        '''
+        return: zobrist hash of the board after color plays a valid move at position
+        '''
+        return self.get_next_hash_at(self.geometry.index[position], color)
+
+    def get_next_hash_at(self, point: int, color: int):
+        groups = self.get_groups()
+        next_hash = self.get_hash() ^ self.__key(point, color)
+        for group in groups.get_neighbors_groups(point):
+            if group.color == -color and group.get_liberty() == 1:
+                for member in group.get_points():
+                    next_hash ^= self.__key(member, -color)
+        return next_hash
 
     '''
     <- methods about positions and ko in board ->
     '''
 
     def get_score(self):
-        white = 0
-        black = 0
-        for position, color in np.ndenumerate(self.board):
-            if color == EMPTY:
-                if self.is_eye(position, WHITE) == True:
-                    white += 1
-                if self.is_eye(position, BLACK) == True:
-                    black += 1
-            else:
-                if color == WHITE:
-                    white += 1
-                if color == BLACK:
-                    black += 1
-        return {WHITE: white, BLACK: black}
+        score = get_area_score(self.board)
+        return {WHITE: int(score[WHITE]), BLACK: int(score[BLACK])}
 
-    def get_valid_moves(self, player: int):
+    def get_valid_moves(self, player: int, history=None):
         '''
+        history: hashes of earlier boards, moves repeating one of them are not valid (positional superko)
         return: valid moves for current board
         '''
-        groups = Groups(self)
-        history = np.zeros([self.x, self.y], dtype=np.int8)
-        for position, color in np.ndenumerate(self.board):
-            if color != EMPTY and history[position[0], position[1]] == 0:
-                group_position_set = set()
-                buffer = []
-                buffer.append(position)
-                while len(buffer) > 0:
-                    curr = buffer.pop()
-                    group_position_set.add(curr)
-                    history[curr] = 1
-                    for neighbor in self.neighbors[curr]:
-                        if self.board[neighbor] == color and history[neighbor] == 0:
-                            buffer.append(neighbor)
+        free_map = self.get_groups().calculate_free_map(player)
+        if history is not None:
+            self.remove_repeats(free_map, player, history)
+        return free_map
 
-                group = Group(self, color)
-                group.position_set = group_position_set
-                groups.add_group(group)
+    def get_all_valid_moves(self):
+        '''
+        return: {WHITE: valid moves, BLACK: valid moves} for current board, from one pass over the groups
+        '''
+        return self.get_groups().calculate_free_maps()
 
-        groups.update_groups_liberty()
-        return groups.calculate_free_map(player)
+    # drop the moves of player in free_map that repeat a board in history
+    def remove_repeats(self, free_map: np.ndarray, player: int, history):
+        # hash change of the stones captured by playing on each liberty of an enemy group in atari
+        captured = {}
+        for group in self.get_groups().group_set:
+            if group.color == -player and group.get_liberty() == 1:
+                key = 0
+                for member in group.get_points():
+                    key ^= self.__key(member, -player)
+                for liberty in group.get_liberty_points():
+                    captured[liberty] = captured.get(liberty, 0) ^ key
+
+        board_hash = self.get_hash()
+        for action in np.flatnonzero(free_map):
+            point = self.geometry.points[action]
+            if board_hash ^ self.__key(point, player) ^ captured.get(point, 0) in history:
+                free_map.flat[action] = 0
+        return free_map
 
     def is_alive_eye(self, position: tuple, color: int):
+        return self.is_alive_eye_at(self.geometry.index[position], color)
+
+    def is_alive_eye_at(self, point: int, color: int):
         same = 0
         total = 0
-        for p in self.neighbors[position]:
+        for p in self.neighbors[point]:
             total += 1
-            if self.board[p] == color:
+            if self.flat[p] == color:
                 same += 1
-        for p in self.diagonal[position]:
+        for p in self.diagonal[point]:
             total += 1
-            if self.board[p] == color:
+            if self.flat[p] == color:
                 same += 1
         if total == same:
             return True
@@ -95,58 +348,46 @@ class Board:
             return False
 
     def is_eye(self, position: tuple, color: int):
-        same = 0
-        total = 0
-        for position in self.neighbors[position]:
-            total += 1
-            if self.board[position] == color:
-                same += 1
-        if total == same:
-            return True
-        else:
-            return False
+        return self.is_eye_at(self.geometry.index[position], color)
+
+    def is_eye_at(self, point: int, color: int):
+        for neighbor in self.neighbors[point]:
+            if self.flat[neighbor] != color:
+                return False
+        return True
 
     def is_suiside(self, position: tuple, color: int):
-        diff = 0
-        total = 0
-        for position in self.neighbors[position]:
-            total += 1
-            if self.board[position] == -color:
-                diff += 1
-        return total == diff
+        for neighbor in self.neighbors[self.geometry.index[position]]:
+            if self.flat[neighbor] != -color:
+                return False
+        return True
 
     def get_size(self):
         return (self.x, self.y)
 
     # add a new stone on board, only when there is empty space
     def add_stone(self, position: tuple, color: int):
-        self.board[position] = color
-        groups = Groups(self)
-        history = np.zeros([self.x, self.y], dtype=np.int8)
-        for pos, c in np.ndenumerate(self.board):
-            if c != EMPTY and history[pos] == 0:
-                group_position_set = set()
-                buffer = []
-                buffer.append(pos)
-                while len(buffer) > 0:
-                    curr = buffer.pop()
-                    group_position_set.add(curr)
-                    history[curr] = 1
-                    for neighbor in self.neighbors[curr]:
-                        if self.board[neighbor] == c and history[neighbor] == 0:
-                            buffer.append(neighbor)
-
-                group = Group(self, c)
-                group.position_set = group_position_set
-                groups.add_group(group)
+        self.add_stone_at(self.geometry.index[position], color)
 
-        groups.update_groups_liberty()
-        groups.kill_dead_group()
-        self.board[position] = color
+    def add_stone_at(self, point: int, color: int):
+        groups = self.get_groups()
+        # a ko only forbids the very next move of that color
+        self.unset_ko(color)
+        self.flat[point] = color
+        if self.hash is not None:
+            self.hash ^= self.__key(point, color)
+            self.flip_hash ^= self.__key(point, -color)
+        groups.place_stone(point, color)
 
     # remove a stone from board(killed)
     def remove_stone(self, position: tuple, color: int):
-        self.board[position] = EMPTY
+        self.remove_stone_at(self.geometry.index[position], color)
+
+    def remove_stone_at(self, point: int, color: int):
+        self.flat[point] = EMPTY
+        if self.hash is not None:
+            self.hash ^= self.__key(point, color)
+            self.flip_hash ^= self.__key(point, -color)
 
     # set a position to be ko
     def set_ko(self, position: tuple, color: int):
@@ -162,14 +403,17 @@ class Board:
 
     # assume i will put a stone here
     def count_neighbors(self, position: tuple, color: int):
+        return self.count_neighbors_at(self.geometry.index[position], color)
+
+    def count_neighbors_at(self, point: int, color: int):
         same = 0
         diff = 0
         total = 0
-        for neighbor in self.neighbors[position]:
+        for neighbor in self.neighbors[point]:
             total += 1
-            if self.board[neighbor] == color:
+            if self.flat[neighbor] == color:
                 same += 1
-            if self.board[neighbor] == -color:
+            if self.flat[neighbor] == -color:
                 diff += 1
         return {"same": same, "diff": diff, "total": total}
 
@@ -177,137 +421,184 @@ class Board:
     <- utilities ->
     '''
 
-    def __is_bound(self, position: tuple):
-        return position[0] % self.x == position[0] and position[1] % self.y == position[1]
+    def __key(self, point: int, color: int):
+        return self.zobrist.keys[color][self.geometry.action[point]]
+
+
+# every set bit of mask as a point index, lowest first
+def iter_bits(mask: int):
+    while mask:
+        bit = mask & -mask
+        mask ^= bit
+        yield bit.bit_length() - 1
 
 
 class Groups:
     def __init__(self, board: "Board"):
         self.board = board
         self.group_set = set()
-        self.position_to_group = {}
+        # group of the stone on every padded point, None where there is no stone
+        self.point_to_group = [None] * len(board.flat)
 
-    def kill_dead_group(self):
-        groups_to_kill = set()
-        for group in self.group_set:
-            if len(group.liberty_positions) == 0:
-                groups_to_kill.add(group)
-        self.group_set.difference_update(groups_to_kill)
-        for group in groups_to_kill:
-            group.kill_self()
-        del groups_to_kill
+    # flood fill the whole board once to find all groups
+    def build(self):
+        flat = self.board.flat
+        for point in self.board.geometry.points:
+            color = flat[point]
+            if color != EMPTY and self.point_to_group[point] is None:
+                group = Group(self.board, color)
+                buffer = [point]
+                while len(buffer) > 0:
+                    curr = buffer.pop()
+                    group.stones |= 1 << curr
+                    self.point_to_group[curr] = group
+                    for neighbor in self.board.neighbors[curr]:
+                        if flat[neighbor] == color and self.point_to_group[neighbor] is None:
+                            buffer.append(neighbor)
+                        elif flat[neighbor] == EMPTY:
+                            group.liberties |= 1 << neighbor
+                self.group_set.add(group)
 
-    def get_all_liberty(self):
-        liberty_set = set()
-        for group in self.group_set:
-            liberty_set.update(group.liberty_positions)
-        return liberty_set
+    # a stone was just put on the board, only update the groups touching it
+    def place_stone(self, point: int, color: int):
+        bit = 1 << point
+        new = Group(self.board, color, bit)
+        friends = {new}
+        enemies = set()
+        for neighbor in self.board.neighbors[point]:
+            group = self.point_to_group[neighbor]
+            if group is None:
+                new.liberties |= 1 << neighbor
+            else:
+                group.liberties &= ~bit
+                if group.color == color:
+                    friends.add(group)
+                else:
+                    enemies.add(group)
 
-    # update the free map
-    def update_free_map(self, color: int):
-        liberty_positions = set()
-        for group in self.group_set:
-            liberty_positions.update(group.liberty_positions)
+        self.add_group(new)
+        merged = self.merge_groups(friends, color)
 
-        for position in liberty_positions:
-            self.board.free_map[position] = self.__is_empty_free(
-                position, color)
+        captured = 0
+        for group in enemies:
+            if group.liberties == 0:
+                captured |= self.capture_group(group)
 
-    def calculate_free_map(self, color: int):
-        free_map = np.ones([self.board.x, self.board.y], dtype=np.int8)
-        for position in self.position_to_group:
-            free_map[position] = 0
+        if merged.liberties == 0:
+            # suicide, valid moves never get here
+            self.capture_group(merged)
+        elif captured & (captured - 1) == 0 and captured and merged.stones == bit and merged.get_liberty() == 1:
+            # the capturing stone can be taken back right away, that is a ko
+            self.board.set_ko(self.board.geometry.position[captured.bit_length() - 1], -color)
 
-        liberty_positions = set()
+    # remove a dead group, its stones become liberties of the groups around
+    def capture_group(self, group: 'Group'):
+        self.remove_group(group)
+        group.kill_self()
+        for member in group.get_points():
+            for neighbor in self.board.neighbors[member]:
+                other = self.point_to_group[neighbor]
+                if other is not None:
+                    other.liberties |= 1 << member
+        return group.stones
+
+    # bitmask of the liberties of every group
+    def get_all_liberty(self):
+        liberties = 0
         for group in self.group_set:
-            liberty_positions.update(group.liberty_positions)
+            liberties |= group.liberties
+        return liberties
 
-        for position in liberty_positions:
-            free_map[position] = self.__is_empty_free(
-                position, color)
+    def calculate_free_map(self, color: int):
+        free_map = self.__stones_free_map()
+        action = self.board.geometry.action
+        for point in iter_bits(self.get_all_liberty()):
+            free_map.flat[action[point]] = self.__is_empty_free(point, color)
         return free_map
 
+    # free maps of both colors, looking at the groups around each liberty once
+    def calculate_free_maps(self):
+        free_maps = {WHITE: self.__stones_free_map()}
+        free_maps[BLACK] = free_maps[WHITE].copy()
+        action = self.board.geometry.action
+        for point in iter_bits(self.get_all_liberty()):
+            neighbor_groups = self.get_neighbors_groups(point)
+            for color in (WHITE, BLACK):
+                free_maps[color].flat[action[point]] = self.__is_empty_free(
+                    point, color, neighbor_groups)
+        return free_maps
+
     def add_group(self, new: 'Group'):
         if new not in self.group_set:
             self.group_set.add(new)
-            for position in new.position_set:
-                self.position_to_group[position] = new
-
-    def delete_group(self, old: 'Group'):
-        self.remove_group(old)
-        old.kill_self()
+            for point in new.get_points():
+                self.point_to_group[point] = new
 
     def remove_group(self, old: 'Group'):
         if old in self.group_set:
-            for position in old.position_set:
-                try:
-                    del self.position_to_group[position]
-                except KeyError:
-                    print("Key not found")
+            for point in old.get_points():
+                self.point_to_group[point] = None
 
         self.group_set.discard(old)
 
-    def find_group(self, position):
-        return self.position_to_group.get(position)
+    def find_group(self, point: int):
+        return self.point_to_group[point]
 
-    # assume all groups are mergeable, merge them to one group
+    # assume all groups are mergeable, merge them into the largest one
     def merge_groups(self, group_list: set, color: int):
         if len(group_list) == 1:
-            group = group_list.pop()
-            self.add_group(group)
-            return
-        else:
-            merged = Group(self.board, color)
-            for curr_group in group_list:
+            return next(iter(group_list))
+        merged = max(group_list, key=lambda group: group.get_size())
+        for curr_group in group_list:
+            if curr_group is not merged:
+                self.group_set.discard(curr_group)
                 merged.add_group(curr_group)
-                self.remove_group(curr_group)
-            self.add_group(merged)
-            return
+                for point in curr_group.get_points():
+                    self.point_to_group[point] = merged
+        return merged
 
-    # update all groups liberty positions
+    # update all groups liberty points
     def update_groups_liberty(self):
         for group in self.group_set:
             group.update_liberty()
 
-    def get_neighbors_liberties(self, x: int, y: int):
-        liberties = []
-        for neighbor in self.board.get_neighbors(x, y):
-            group = self.position_to_group[neighbor]
-            if group != None:
-                liberties.append(group.get_liberty())
-            else:
-                liberties.append(4)
-        return liberties
-
     def print(self):
         print("---> groups:")
         for group in self.group_set:
             group.print()
 
-    def get_neighbors_groups(self, x: int, y: int):
+    def get_neighbors_groups(self, point: int):
         neighbors_groups = set()
-        for neighbor in self.board.neighbors[x, y]:
-            if self.board.board[neighbor] != EMPTY:
-                group = self.position_to_group[neighbor]
+        for neighbor in self.board.neighbors[point]:
+            group = self.point_to_group[neighbor]
+            if group is not None:
                 neighbors_groups.add(group)
         return neighbors_groups
 
-    # assume a position is empty, check if we can put a new stone there
-    def __is_empty_free(self, position: tuple, color: int):
-        x = position[0]
-        y = position[1]
+    # 1 on every point, 0 on the stones
+    def __stones_free_map(self):
+        free_map = np.ones(self.board.x * self.board.y, dtype=np.int8)
+        action = self.board.geometry.action
+        for group in self.group_set:
+            for point in group.get_points():
+                free_map[action[point]] = 0
+        return free_map.reshape(self.board.x, self.board.y)
+
+    # assume a point is empty, check if we can put a new stone there
+    def __is_empty_free(self, point: int, color: int, neighbor_groups: set = None):
         # can not place in ko
         if color == BLACK:
-            if (x, y) in self.board.ko[BLACK]:
+            if self.board.ko[BLACK] and self.board.geometry.position[point] in self.board.ko[BLACK]:
                 return False
         elif color == WHITE:
-            if (x, y) in self.board.ko[WHITE]:
+            if self.board.ko[WHITE] and self.board.geometry.position[point] in self.board.ko[WHITE]:
                 return False
         else:
             raise ValueError("wrong color")
 
-        count = self.board.count_neighbors(position, color)
-        neighbor_groups = self.get_neighbors_groups(x, y)
+        count = self.board.count_neighbors_at(point, color)
+        if neighbor_groups is None:
+            neighbor_groups = self.get_neighbors_groups(point)
         same_color_count = 0
         same_color_liberty = 0
         for group in neighbor_groups:
@@ -323,65 +614,557 @@ class Groups:
                 print("error color")
 
         # can not suicide and can not be eye
-        if count["diff"] == count["total"] or (same_color_count == same_color_liberty and count["total"] == count["diff"] + count["same"]) or self.board.is_alive_eye((x, y), color):
+        if count["diff"] == count["total"] or (same_color_count == same_color_liberty and count["total"] == count["diff"] + count["same"]) or self.board.is_alive_eye_at(point, color):
             return False
         else:
             return True
 
 
 class Group:
-    def __init__(self, board: "Board", color: int):
+    '''
+    Stones of one color connected together. The stones and their liberties are bitmasks of
+    padded points (bit p is set for point p), and two groups are only equal if they are the same.
+    '''
+    __slots__ = ("board", "color", "stones", "liberties")
+
+    def __init__(self, board: "Board", color: int, stones: int = 0, liberties: int = 0):
         self.board = board
         self.color = color
-        self.position_set = set()
-        self.liberty_positions = set()
-
-    def __eq__(self, other):
-        return self.__repr__() == other.__repr__()
-
-    def __hash__(self):
-        return hash(self.__repr__())
+        self.stones = stones
+        self.liberties = liberties
 
     def print(self):
         print_board = np.zeros([self.board.x, self.board.y], dtype=np.int8)
-        for position in self.position_set:
-            print_board[position[0], position[1]] = 1
-        for position in self.liberty_positions:
-            print_board[position[0], position[1]] = -1
+        action = self.board.geometry.action
+        for point in self.get_points():
+            print_board.flat[action[point]] = 1
+        for point in self.get_liberty_points():
+            print_board.flat[action[point]] = -1
         print(print_board)
 
     def is_member(self, x: int, y: int):
-        return (x, y) in self.position_set
+        return self.stones >> self.board.geometry.index[(x, y)] & 1 == 1
 
     def add_group(self, group: "Group"):
-        self.position_set.update(group.position_set)
-        self.liberty_positions.update(group.liberty_positions)
-        self.liberty_positions.difference_update(self.position_set)
+        self.stones |= group.stones
+        self.liberties = (self.liberties | group.liberties) & ~self.stones
 
     # add_member assume the new member is free to add, and neighbor to the current group
 
-    def add_position(self, position: tuple):
-        self.position_set.add(position)
-        for position in self.board.neighbors[position]:
-            if self.board.board[position] == EMPTY:
-                self.liberty_positions.add(position)
+    def add_point(self, point: int):
+        self.stones |= 1 << point
+        self.liberties &= ~(1 << point)
+        for neighbor in self.board.neighbors[point]:
+            if self.board.flat[neighbor] == EMPTY:
+                self.liberties |= 1 << neighbor
+
+    def get_points(self):
+        return iter_bits(self.stones)
+
+    def get_liberty_points(self):
+        return iter_bits(self.liberties)
+
+    def get_size(self):
+        return bin(self.stones).count("1")
 
     def get_liberty(self):
-        return len(self.liberty_positions)
+        return bin(self.liberties).count("1")
 
     def update_liberty(self):
-        self.liberty_positions = set()
-        for member in self.position_set:
-            for position in self.board.neighbors[member]:
-                if self.board.board[position] == EMPTY:
-                    self.liberty_positions.add(position)
+        liberties = 0
+        for member in self.get_points():
+            for neighbor in self.board.neighbors[member]:
+                if self.board.flat[neighbor] == EMPTY:
+                    liberties |= 1 << neighbor
+        self.liberties = liberties
 
     def contains(self, x: int, y: int):
-        return (x, y) in self.position_set
+        return self.is_member(x, y)
 
     def kill_self(self):
-        for member in self.position_set:
-            self.board.remove_stone(member, self.color)
-        if len(self.position_set) == 1:
-            member = self.position_set.pop()
-            self.board.set_ko(member, self.color)
+        for member in self.get_points():
+            self.board.remove_stone_at(member, self.color)
+
+
+class BitBoard:
+    '''
+    Same rules as Board, but the stones are kept as two python int bitboards
+    (bit r*y + c is the point (r, c)) and every query is done with shifts and masks.
+    '''
+
+    def __init__(self, x: int, y: int):
+        self.x = x
+        self.y = y
+        self.ko = {BLACK: set(), WHITE: set()}
+        self.stones = {BLACK: 0, WHITE: 0}
+        self.zobrist = Zobrist.get(x, y)
+        self.hash = None
+        self.flip_hash = None
+
+        geometry = Geometry.get(x, y)
+        self.full = geometry.full
+        self.not_left = geometry.not_left
+        self.not_right = geometry.not_right
+        self.interior = geometry.interior
+
+    @property
+    def board(self):
+        board = np.zeros(self.x * self.y, dtype=np.int8)
+        board[self.__to_array(self.stones[WHITE])] = WHITE
+        board[self.__to_array(self.stones[BLACK])] = BLACK
+        return board.reshape(self.x, self.y)
+
+    @board.setter
+    def board(self, board: np.ndarray):
+        self.stones[WHITE] = self.__from_array(board == WHITE)
+        self.stones[BLACK] = self.__from_array(board == BLACK)
+        self.hash = None
+        self.flip_hash = None
+
+    def get_hash(self):
+        '''
+        return: zobrist hash of current board, computed once and then updated by add_stone
+        '''
+        if self.hash is None:
+            board = self.board
+            self.hash = self.zobrist.hash(board)
+            self.flip_hash = self.zobrist.hash(-board)
+        return self.hash
+
+    def get_flip_hash(self):
+        '''
+        return: zobrist hash of current board with colors flipped
+        '''
+        self.get_hash()
+        return self.flip_hash
+
+    def get_next_hash(self, position: tuple, color: int):
+        '''
+        return: zobrist hash of the board after color plays a valid move at position
+        '''
+        bit = self.__bit(position)
+        empty = self.get_empty() & ~bit
+        captured = 0
+        for group in self.__groups(self.shift(bit) & self.stones[-color], self.stones[-color]):
+            if self.shift(group) & empty == 0:
+                captured |= group
+        return self.get_hash() ^ self.__keys(bit, color) ^ self.__keys(captured, -color)
+
+    '''
+    <- methods about positions and ko in board ->
+    '''
+
+    def get_score(self):
+        empty = self.get_empty()
+        white = self.__eyes(empty, WHITE)
+        black = self.__eyes(empty, BLACK)
+        return {WHITE: self.__count(self.stones[WHITE] | white),
+                BLACK: self.__count(self.stones[BLACK] | black)}
+
+    def get_valid_moves(self, player: int, history=None):
+        '''
+        history: hashes of earlier boards, moves repeating one of them are not valid (positional superko)
+        return: valid moves for current board
+        '''
+        return self.__to_board(self.get_valid_mask(player, history))
+
+    def get_valid_mask(self, player: int, history=None):
+        '''
+        return: get_valid_moves as a bitboard
+        '''
+        free = self.__free(player, self.get_empty(), self.__atari(player), self.__atari(-player))
+        if history is not None:
+            free = self.__remove_repeats(free, player, history)
+        return free
+
+    def get_next_hashes(self, mask: int, player: int):
+        '''
+        return: [(bit, zobrist hash of the board after player plays there)] for every valid move in mask
+        '''
+        # hash change of the stones captured by playing on each liberty of an enemy group in atari
+        captured = {}
+        empty = self.get_empty()
+        for group in self.__groups(self.stones[-player]):
+            liberty = self.shift(group) & empty
+            if liberty & (liberty - 1) == 0:
+                captured[liberty] = captured.get(liberty, 0) ^ self.__keys(group, -player)
+
+        board_hash = self.get_hash()
+        return [(move, board_hash ^ self.__keys(move, player) ^ captured.get(move, 0)) for move in self.__bits(mask)]
+
+    def is_end(self):
+        '''
+        return: True if neither color has a valid move
+        '''
+        empty = self.get_empty()
+        atari = {WHITE: self.__atari(WHITE), BLACK: self.__atari(BLACK)}
+        return not any(self.__free(color, empty, atari[color], atari[-color]) for color in (WHITE, BLACK))
+
+    # write the points of mask into the flat vector out, without making a new array
+    def fill(self, mask: int, out: np.ndarray):
+        out[:] = 0
+        for bit in self.__bits(mask):
+            out[bit.bit_length() - 1] = 1
+        return out
+
+    def get_all_valid_moves(self):
+        '''
+        return: {WHITE: valid moves, BLACK: valid moves} for current board, looking at every group once
+        '''
+        empty = self.get_empty()
+        atari = {WHITE: self.__atari(WHITE), BLACK: self.__atari(BLACK)}
+        return {color: self.__to_board(self.__free(color, empty, atari[color], atari[-color]))
+                for color in (WHITE, BLACK)}
+
+    # drop the moves of player in free_map that repeat a board in history
+    def remove_repeats(self, free_map: np.ndarray, player: int, history):
+        free = self.__remove_repeats(self.__from_array(free_map != 0), player, history)
+        free_map[...] = self.__to_board(free)
+        return free_map
+
+    def is_alive_eye(self, position: tuple, color: int):
+        return self.__alive_eyes(self.__bit(position), color) != 0
+
+    def is_eye(self, position: tuple, color: int):
+        return self.__eyes(self.__bit(position), color) != 0
+
+    def is_suiside(self, position: tuple, color: int):
+        return self.shift(self.__bit(position)) & ~self.stones[-color] == 0
+
+    def get_size(self):
+        return (self.x, self.y)
+
+    def get_empty(self):
+        return self.full & ~(self.stones[WHITE] | self.stones[BLACK])
+
+    # add a new stone on board, only when there is empty space
+    def add_stone(self, position: tuple, color: int):
+        self.unset_ko(color)
+        bit = self.__bit(position)
+        self.stones[color] |= bit
+        if self.hash is not None:
+            self.hash ^= self.__keys(bit, color)
+            self.flip_hash ^= self.__keys(bit, -color)
+
+        captured = 0
+        empty = self.get_empty()
+        for group in self.__groups(self.shift(bit) & self.stones[-color], self.stones[-color]):
+            if self.shift(group) & empty == 0:
+                captured |= group
+        self.stones[-color] &= ~captured
+        if self.hash is not None:
+            self.hash ^= self.__keys(captured, -color)
+            self.flip_hash ^= self.__keys(captured, color)
+
+        own = self.__flood(bit, self.stones[color])
+        liberty = self.shift(own) & self.get_empty()
+        if liberty == 0:
+            # suicide, valid moves never get here
+            self.stones[color] &= ~own
+            if self.hash is not None:
+                self.hash ^= self.__keys(own, color)
+                self.flip_hash ^= self.__keys(own, -color)
+        elif own == bit and liberty == captured and captured & (captured - 1) == 0:
+            # the capturing stone can be taken back right away, that is a ko
+            self.set_ko(self.__position(captured), -color)
+        return captured
+
+    def play(self, position: tuple, color: int):
+        '''
+        add_stone for a valid move (None to pass), ko is only kept from the last move
+        return: undo record of the move, the stones it captured and the ko and hashes before it
+        '''
+        record = (0 if position is None else self.__bit(position), color, 0, self.ko, self.hash, self.flip_hash)
+        self.ko = {BLACK: set(), WHITE: set()}
+        if position is None:
+            return record
+        captured = self.add_stone(position, color)
+        return record[:2] + (captured,) + record[3:]
+
+    # take back the move of a record returned by play
+    def undo(self, record: tuple):
+        bit, color, captured, self.ko, self.hash, self.flip_hash = record
+        self.stones[color] &= ~bit
+        self.stones[-color] |= captured
+
+    # swap the colors of every stone, ko and hash in place
+    def flip(self):
+        self.stones[WHITE], self.stones[BLACK] = self.stones[BLACK], self.stones[WHITE]
+        self.ko = {WHITE: self.ko[BLACK], BLACK: self.ko[WHITE]}
+        self.hash, self.flip_hash = self.flip_hash, self.hash
+
+    # remove a stone from board(killed)
+    def remove_stone(self, position: tuple, color: int):
+        self.stones[color] &= ~self.__bit(position)
+        if self.hash is not None:
+            self.hash ^= self.__keys(self.__bit(position), color)
+            self.flip_hash ^= self.__keys(self.__bit(position), -color)
+
+    # set a position to be ko
+    def set_ko(self, position: tuple, color: int):
+        self.ko[color].add(position)
+
+    # unset a ko position
+    def unset_ko(self, color: int):
+        self.ko[color].clear()
+
+    '''
+    <- shift and mask utilities ->
+    '''
+
+    # all points next to the given points
+    def shift(self, mask: int):
+        return (((mask << 1) & self.not_left) | ((mask >> 1) & self.not_right) |
+                (mask << self.y) | (mask >> self.y)) & self.full
+
+    # all points diagonal to the given points
+    def shift_diagonal(self, mask: int):
+        up_down = (mask << self.y) | (mask >> self.y)
+        return (((up_down << 1) & self.not_left) | ((up_down >> 1) & self.not_right)) & self.full
+
+    # (liberties of the groups of color in atari, stones of the groups of color with more liberties)
+    def __atari(self, color: int):
+        empty = self.get_empty()
+        atari = 0
+        safe = 0
+        for group in self.__groups(self.stones[color]):
+            liberty = self.shift(group) & empty
+            if liberty & (liberty - 1) == 0:
+                atari |= liberty
+            else:
+                safe |= group
+        return atari, safe
+
+    def __free(self, player: int, empty: int, own_atari: tuple, other_atari: tuple):
+        # empty points where a stone would capture an enemy group in atari
+        capture = other_atari[0]
+        # own stones that still have a liberty after a stone is put next to them
+        safe = own_atari[1]
+
+        # empty points next to no stone at all are always free
+        lonely = empty & ~self.shift(self.stones[WHITE] | self.stones[BLACK])
+        surrounded = empty & ~self.shift(empty)
+        suicide = surrounded & ~self.shift(safe)
+
+        ko = self.__from_positions(self.ko[player])
+        return lonely | (empty & ~ko & (capture | ~(suicide | self.__alive_eyes(empty, player))))
+
+    def __remove_repeats(self, free: int, player: int, history):
+        for move, next_hash in self.get_next_hashes(free, player):
+            if next_hash in history:
+                free &= ~move
+        return free
+
+    def __to_board(self, mask: int):
+        board = np.zeros(self.x * self.y, dtype=np.int8)
+        board[self.__to_array(mask)] = 1
+        return board.reshape(self.x, self.y)
+
+    def __eyes(self, mask: int, color: int):
+        return mask & ~self.shift(self.full & ~self.stones[color])
+
+    def __alive_eyes(self, mask: int, color: int):
+        other = self.full & ~self.stones[color]
+        # every neighbor is the same color
+        eyes = mask & ~(self.shift(other) | self.shift_diagonal(other))
+        # or exactly one of 8 neighbors is not
+        once = 0
+        twice = 0
+        for direction in self.__directions(other):
+            twice |= once & direction
+            once |= direction
+        return eyes | (mask & self.interior & once & ~twice)
+
+    # the 8 masks of points whose neighbor in one direction is in mask
+    def __directions(self, mask: int):
+        up = mask >> self.y
+        down = (mask << self.y) & self.full
+        for row in (mask, up, down):
+            yield (row << 1) & self.not_left
+            yield (row >> 1) & self.not_right
+        yield up
+        yield down
+
+    def __flood(self, seed: int, mask: int):
+        group = seed
+        while True:
+            grown = group | (self.shift(group) & mask)
+            if grown == group:
+                return group
+            group = grown
+
+    # split the stones in mask into groups, starting only from points in seeds
+    def __groups(self, seeds: int, mask: int = None):
+        if mask is None:
+            mask = seeds
+        while seeds:
+            group = self.__flood(seeds & -seeds, mask)
+            seeds &= ~group
+            yield group
+
+    # every single bit of mask
+    def __bits(self, mask: int):
+        while mask:
+            bit = mask & -mask
+            mask ^= bit
+            yield bit
+
+    # xor of the zobrist keys of the stones in mask
+    def __keys(self, mask: int, color: int):
+        keys = self.zobrist.keys[color]
+        h = 0
+        for bit in self.__bits(mask):
+            h ^= keys[bit.bit_length() - 1]
+        return h
+
+    def __bit(self, position: tuple):
+        return 1 << int(position[0] * self.y + position[1])
+
+    def __position(self, bit: int):
+        return divmod(bit.bit_length() - 1, self.y)
+
+    def __from_positions(self, positions: set):
+        mask = 0
+        for position in positions:
+            mask |= self.__bit(position)
+        return mask
+
+    def __count(self, mask: int):
+        return bin(mask).count("1")
+
+    def __to_array(self, mask: int):
+        data = np.frombuffer(mask.to_bytes((self.x * self.y + 7) // 8, "little"), dtype=np.uint8)
+        return np.unpackbits(data, bitorder="little")[:self.x * self.y].astype(bool)
+
+    def __from_array(self, array: np.ndarray):
+        return int.from_bytes(np.packbits(array.ravel(), bitorder="little").tobytes(), "little")
+
+
+class BatchBoard:
+    '''
+    Same rules as Board, run on a whole batch of boards with shape (N, x, y) at once.
+    Every query is a handful of numpy operations over all boards, there is no
+    python loop over boards or points.
+    '''
+
+    def __init__(self, x: int, y: int):
+        self.x = x
+        self.y = y
+        self.size = x * y
+        # index of each neighbor of every point, self.size for outside the board
+        geometry = Geometry.get(x, y)
+        self.neighbors = geometry.neighbor_table
+        self.diagonal = geometry.diagonal_table
+
+    def get_valid_moves(self, boards: np.ndarray, player):
+        '''
+        return: valid moves for every board, shape (N, x, y)
+        '''
+        flat = boards.reshape(-1, self.size)
+        free = self.__free(flat, *self.__analyse(flat), self.__colors(flat, player))
+        return free.astype(np.int8).reshape(boards.shape)
+
+    def is_end(self, boards: np.ndarray):
+        '''
+        return: for every board, True if no player has a valid move
+        '''
+        flat = boards.reshape(-1, self.size)
+        analysis = self.__analyse(flat)
+        ended = np.ones(len(flat), dtype=bool)
+        for color in (WHITE, BLACK):
+            ended &= ~self.__free(flat, *analysis, self.__colors(flat, color)).any(axis=1)
+        return ended
+
+    def get_score(self, boards: np.ndarray):
+        '''
+        return: {WHITE: scores, BLACK: scores} with one score per board
+        '''
+        return get_area_score(boards.reshape(-1, self.x, self.y))
+
+    def add_stones(self, boards: np.ndarray, actions: np.ndarray, player):
+        '''
+        put a stone of player on every board at its action (-1 to pass)
+        return: new boards, the given boards are not changed
+        '''
+        flat = boards.reshape(-1, self.size).copy()
+        color = self.__colors(flat, player)
+        actions = np.asarray(actions)
+        moved = np.flatnonzero(actions >= 0)
+        flat[moved, actions[moved]] = color[moved]
+
+        labels = self.__label(flat, self.__around(flat, self.neighbors))
+        liberty = self.__count_liberty(flat, labels)
+        stone_liberty = np.take_along_axis(liberty, labels, axis=1)
+        flat[(flat == -color[:, None]) & (stone_liberty == 0)] = EMPTY
+
+        # suicide, valid moves never get here
+        dead = (flat == color[:, None]) & (stone_liberty == 0)
+        if dead.any():
+            liberty = self.__count_liberty(flat, labels)
+            stone_liberty = np.take_along_axis(liberty, labels, axis=1)
+            flat[(flat == color[:, None]) & (stone_liberty == 0)] = EMPTY
+        return flat.reshape(boards.shape)
+
+    '''
+    <- array utilities ->
+    '''
+
+    # neighbors of every point and liberty count of the group of each neighbor
+    def __analyse(self, flat: np.ndarray):
+        around = self.__around(flat, self.neighbors)
+        labels = self.__label(flat, around)
+        liberty = self.__count_liberty(flat, labels)
+        group_liberty = np.take_along_axis(
+            liberty, self.__around(labels, self.neighbors, self.size).reshape(len(flat), -1), axis=1
+        ).reshape(around.shape)
+        return around, group_liberty
+
+    def __free(self, flat: np.ndarray, around: np.ndarray, group_liberty: np.ndarray, color: np.ndarray):
+        own = around == color[:, None, None]
+        other = around == -color[:, None, None]
+        lonely = ~(own | other).any(axis=2)
+        capture = (other & (group_liberty == 1)).any(axis=2)
+        surrounded = ~(around == EMPTY).any(axis=2)
+        suicide = surrounded & ~(own & (group_liberty > 1)).any(axis=2)
+        return (flat == EMPTY) & (lonely | capture | ~(suicide | self.__alive_eyes(flat, color)))
+
+    def __colors(self, flat: np.ndarray, player):
+        return np.broadcast_to(np.asarray(player, dtype=np.int8), (len(flat),))
+
+    # value of every neighbor of every point, shape (N, size, 4)
+    def __around(self, flat: np.ndarray, table: np.ndarray, outside=OUTSIDE):
+        padded = np.concatenate(
+            [flat, np.full([len(flat), 1], outside, dtype=flat.dtype)], axis=1)
+        return padded[:, table]
+
+    # label every stone with the smallest point index of its group, empty points get self.size
+    def __label(self, flat: np.ndarray, around: np.ndarray):
+        stone = flat != EMPTY
+        same = stone[:, :, None] & (around == flat[:, :, None])
+        labels = np.where(stone, np.arange(self.size), self.size)
+        # only boards whose labels still change are processed again
+        active = np.arange(len(flat))
+        while len(active) > 0:
+            curr = labels[active]
+            neighbor_labels = self.__around(curr, self.neighbors, self.size)
+            merged = curr
+            for k in range(4):
+                merged = np.minimum(merged, np.where(same[active, :, k], neighbor_labels[:, :, k], self.size))
+            # jump to the label of the label to spread along long groups quickly
+            merged = np.take_along_axis(
+                np.concatenate([merged, np.full([len(active), 1], self.size)], axis=1), merged, axis=1)
+            changed = (merged != curr).any(axis=1)
+            labels[active] = merged
+            active = active[changed]
+        return labels
+
+    # number of liberties of every label, shape (N, size + 1)
+    def __count_liberty(self, flat: np.ndarray, labels: np.ndarray):
+        neighbor_labels = self.__around(labels, self.neighbors, self.size)
+        board, point, direction = np.nonzero((flat == EMPTY)[:, :, None] & (neighbor_labels < self.size))
+        liberty = np.zeros([len(flat), self.size + 1, self.size], dtype=bool)
+        liberty[board, neighbor_labels[board, point, direction], point] = True
+        return liberty.sum(axis=2)
+
+    def __alive_eyes(self, flat: np.ndarray, color: np.ndarray):
+        return get_alive_eyes(flat.reshape(-1, self.x, self.y), color).reshape(flat.shape)
@@ -3,6 +3,7 @@ import torch.optim as optim
 import torch.nn.functional as F
 import torch.nn as nn
 import torch
+import itertools
 import os
 import shutil
 import time
@@ -17,16 +18,37 @@ args = dotdict({
     'dropout': 0.8,
     'batch_size': 32,
     'hidden': 512,
+    # the GPU when there is one, a Model can also be given its own device
+    'device': 'cuda' if torch.cuda.is_available() else 'cpu',
+    # threads torch runs one CPU forward pass on, None keeps the torch default
+    'threads': None,
 })
 
 
 class Model():
-    def __init__(self, game):
+    # versions of weights, unique in the process, for caches of evaluations like MCTS.eval_cache
+    versions = itertools.count()
+
+    def __init__(self, game, device=None, threads=None):
         self.epoch_num = 10
         self.nnet = NNet(game, args)
+        self.version = next(Model.versions)
         self.x, self.y = game.get_board_size()
         self.action_size = game.get_action_size()
-        self.nnet.cuda()
+        self.device = torch.device(device if device is not None else args.device)
+        self.nnet.to(self.device)
+        # set for the whole process, a worker searching alone can use every core
+        threads = threads if threads is not None else args.threads
+        if threads is not None:
+            torch.set_num_threads(threads)
+        # the network stays in eval mode outside of train
+        self.nnet.eval()
+        # input of predict, boards are copied into it instead of making a new tensor
+        self.input = torch.empty((1, self.x, self.y), device=self.device)
+        # inputs of predict_batch, grown to the largest batch so far, and the pinned
+        # host copy they are sent to the GPU from
+        self.inputs = None
+        self.staging = None
 
     def train(self, examples):
         """
@@ -45,10 +67,10 @@ class Model():
                 ids = np.random.randint(len(examples), size=args.batch_size)
                 state, policy, v = list(zip(*[examples[i] for i in ids]))
 
-                state = torch.Tensor(np.array(state)).contiguous().cuda()
+                state = torch.Tensor(np.array(state)).contiguous().to(self.device)
                 target_policy = torch.Tensor(
-                    np.array(policy)).contiguous().cuda()
-                target_v = torch.Tensor(np.array(v)).contiguous().cuda()
+                    np.array(policy)).contiguous().to(self.device)
+                target_v = torch.Tensor(np.array(v)).contiguous().to(self.device)
 
                 # predict
                 self.nnet.eval()
@@ -76,6 +98,7 @@ class Model():
                 total_batch_num += 1
             print('epoch: {}, loss: {}'.format(epoch, epoch_loss/batch_idx))
         self.nnet.eval()
+        self.version = next(Model.versions)
         return average_loss / total_batch_num
 
     def predict(self, board):
@@ -83,13 +106,35 @@ class Model():
         board: np array with board
         """
         # preparing input
-        board = torch.Tensor(board.astype(np.float64))
-        board = board.contiguous().cuda()
-        board = board.view(1, self.x, self.y)
-        self.nnet.eval()
-        with torch.no_grad():
-            policy, v = self.nnet(board)
-        return policy.data.cpu().numpy()[0], v.data.cpu().numpy()[0]
+        with torch.inference_mode():
+            self.input[0].copy_(torch.from_numpy(np.ascontiguousarray(board)))
+            policy, v = self.nnet(self.input)
+        return policy.cpu().numpy()[0], v.cpu().numpy()[0]
+
+    def predict_batch(self, boards):
+        """
+        boards: np array of boards, shape (N, x, y)
+        Returns:
+            policies shape (N, action_size), values shape (N,)
+        """
+        n = len(boards)
+        if self.inputs is None or len(self.inputs) < n:
+            self.__grow(n)
+        with torch.inference_mode():
+            boards = torch.from_numpy(np.ascontiguousarray(boards))
+            if self.staging is None:
+                inputs = self.inputs[:n].copy_(boards)
+            else:
+                inputs = self.inputs[:n].copy_(self.staging[:n].copy_(boards), non_blocking=True)
+            policies, v = self.nnet(inputs)
+        return policies.cpu().numpy(), v.cpu().numpy()[:, 0]
+
+    # make the predict_batch buffers hold at least n boards
+    def __grow(self, n):
+        size = max(n, 2*len(self.inputs) if self.inputs is not None else 1)
+        self.inputs = torch.empty((size, self.x, self.y), device=self.device)
+        if self.device.type == "cuda":
+            self.staging = torch.empty((size, self.x, self.y), pin_memory=True)
 
     def save_checkpoint(self, folder='train', filename='checkpoint.pth.tar'):
         filepath = os.path.join(folder, filename)
@@ -103,8 +148,10 @@ class Model():
         filepath = os.path.join(folder, filename)
         if not os.path.exists(filepath):
             raise("no model in {}".format(filepath))
-        checkpoint = torch.load(filepath)
+        # tensors saved on a GPU are loaded straight onto this Model's device
+        checkpoint = torch.load(filepath, map_location=self.device)
         self.nnet.load_state_dict(checkpoint['state_dict'])
+        self.version = next(Model.versions)
 
     def loss(self, targets_p, outputs_p, target_v, outputs_v):
         '''
@@ -0,0 +1,128 @@
+from game import Game, WHITE, BLACK, EMPTY
+from game_logic import BitBoard, Geometry, iter_bits
+import numpy as np
+
+
+class Rollout():
+    '''
+    Network-free evaluator with the predict / predict_batch of Model, for MCTS
+    without a network. The policy is uniform over the board and the value is the
+    mean result of random playouts from the board.
+    Few playouts run one at a time on a BitBoard. Many playouts run together on
+    the batched rules of Game, a few numpy operations per move for all of them,
+    which only pays off once a batch has batch_threshold playouts or more.
+    Both follow the ko of BitBoard: a single stone that captures a single stone
+    can not be taken back on the next move.
+    '''
+
+    # playouts in one call from which the batched rules are faster than a BitBoard
+    batch_threshold = 256
+
+    def __init__(self, game: "Game", rollouts=4, max_moves=None, seed=None):
+        self.game = game
+        self.rollouts = rollouts
+        self.n = game.n
+        self.action_size = game.get_action_size()
+        # same cut-off as BattleGround, random play can cycle through captures
+        self.max_moves = max_moves if max_moves is not None else self.action_size*2
+        self.random = np.random.RandomState(seed)
+        # neighbors of every point, size for outside the board
+        self.neighbors = Geometry.get(self.n, self.n).neighbor_table
+
+    def predict(self, board: np.ndarray):
+        """
+        board: standard board, player 1 to move
+        Returns:
+            uniform policy, value of board shape (1,)
+        """
+        policies, values = self.predict_batch(board[np.newaxis])
+        return policies[0], values[:1]
+
+    def predict_batch(self, boards: np.ndarray):
+        """
+        boards: standard boards, player 1 to move
+        Returns:
+            uniform policies shape (N, action_size), values shape (N,)
+        """
+        policies = np.full((len(boards), self.action_size), 1/self.action_size)
+        boards = np.repeat(boards, self.rollouts, axis=0)
+        if len(boards) >= Rollout.batch_threshold:
+            results = self.play_out_batch(boards)
+        else:
+            results = np.array([self.play_out(board) for board in boards])
+        return policies, results.reshape(-1, self.rollouts).mean(axis=1)
+
+    def play_out(self, board: np.ndarray):
+        """
+        play random valid moves on board, player 1 first, until both players
+        pass or max_moves
+        Returns:
+            r: get_current_win_lose of the final board for player 1
+        """
+        b = BitBoard(self.n, self.n)
+        b.board = board
+        color = WHITE
+        passes = 0
+        for _ in range(self.max_moves):
+            moves = list(iter_bits(b.get_valid_mask(color)))
+            if len(moves) == 0:
+                passes += 1
+                if passes >= 2:
+                    break
+                b.play(None, color)
+            else:
+                passes = 0
+                b.play(divmod(moves[self.random.randint(len(moves))], self.n), color)
+            color = -color
+
+        score = b.get_score()
+        if score[WHITE] > score[BLACK]:
+            return 1
+        elif score[WHITE] < score[BLACK]:
+            return -1
+        return 1e-12
+
+    def play_out_batch(self, boards: np.ndarray):
+        """
+        play_out of every board, all playouts stepping together
+        Returns:
+            r: get_current_win_lose of every final board for player 1
+        """
+        boards = boards.copy()
+        passes = np.zeros(len(boards), dtype=np.int8)
+        # point the player to move can not play because of ko, -1 for none
+        ko = np.full(len(boards), -1)
+        # playouts still running, the others are left out of every rules call
+        active = np.arange(len(boards))
+        player = 1
+        for _ in range(self.max_moves):
+            before = boards[active]
+            valids = self.game.get_valid_moves_batch(before, player)
+            rows = np.flatnonzero(ko[active] >= 0)
+            valids[rows, ko[active][rows]] = 0
+            # uniform choice among valid moves, pass when there is none
+            scores = self.random.random_sample(valids.shape)*valids
+            movable = valids.any(axis=1)
+            actions = np.where(movable, scores.argmax(axis=1), -1)
+            boards[active], _ = self.game.get_next_state_batch(before, player, actions)
+            ko[active] = self.__ko(before, boards[active], actions, player)
+
+            passes[active] = np.where(movable, 0, passes[active] + 1)
+            active = active[passes[active] < 2]
+            if len(active) == 0:
+                break
+            player = -player
+        return self.game.get_current_win_lose_batch(boards, 1)
+
+    # the ko point left for the next player by every move, -1 where there is none
+    def __ko(self, before: np.ndarray, after: np.ndarray, actions: np.ndarray, player: int):
+        before = before.reshape(len(before), -1)
+        after = after.reshape(len(after), -1)
+        captured = (before == -player) & (after == EMPTY)
+        # 2 marks the outside of the board, neither a stone nor empty
+        padded = np.concatenate([after, np.full((len(after), 1), 2, dtype=after.dtype)], axis=1)
+        around = padded[np.arange(len(after))[:, None], self.neighbors[np.maximum(actions, 0)]]
+        # the new stone is alone and its only liberty is the one stone it captured
+        lone = ~(around == player).any(axis=1) & (np.count_nonzero(around == EMPTY, axis=1) == 1)
+        single = np.count_nonzero(captured, axis=1) == 1
+        return np.where((actions >= 0) & single & lone, captured.argmax(axis=1), -1)
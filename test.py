@@ -1,7 +1,7 @@
 from battle import BattleGround
 from game import Game
-from model import Model
 from mcts import MCTS
+from rollout import Rollout
 
 import pandas as pd
 import numpy as np
@@ -24,9 +24,11 @@ def test_MCTS(n, num_iter=100):
     print("player1 = {}, player2 = {}".format("MCTS", "Baseline"))
     game = Game(n)
     random_player = RandomPlayer(game)
-    model = Model(game)
-    args = dotdict({'tree_search_count': 2*n**2, 'cpuct': 1.0})
-    mcts = MCTS(game, model, args)
+    # uniform priors and random playouts, no network
+    rollout = Rollout(game)
+    # one MCTS plays every game, bound the nodes it keeps
+    args = dotdict({'tree_search_count': 2*n**2, 'cpuct': 1.0, 'max_nodes': 200000, 'instrument': True})
+    mcts = MCTS(game, rollout, args)
     def nnet_player(board): return mcts.calculate_p_v(
         board, exhaust=True, withoutNN=True)
 
@@ -35,6 +37,11 @@ def test_MCTS(n, num_iter=100):
     ai, baseline, draw = bg.playGames(int(num_iter/2))
     perf = mcts.calculate_performance()
     print("--> Performance: {} node/step".format(perf))
+    print("--> Network batch: {} leaves/call".format(mcts.calculate_batch_size()))
+    print("--> Tree: {}".format(mcts.nodes.stats()))
+    print("--> Evaluation cache: {}".format(MCTS.eval_cache.stats()))
+    pd.DataFrame(mcts.stats.rows).to_csv(
+        './plots/search_mcts_{}x{}.csv'.format(n, n), sep=',')
     print("--> Result: MCTS/Baseline wins = {}/{}, MCTS win rate = {}\n".format(ai,
                                                                                 baseline, ai/(ai + baseline + draw)))
     return (perf, ai/(ai + baseline + draw))
@@ -45,9 +52,12 @@ def test_MCTS_with_NNet(n, num_iter=100):
     print("player1 = {}, player2 = {}".format("AI", "Baseline"))
     game = Game(n)
     random_player = RandomPlayer(game)
+    # torch is only needed from here, test_MCTS runs without it
+    from model import Model
     model = Model(game)
     model.load_checkpoint('models', 'model_{}x{}.pth.tar'.format(n, n))
-    args = dotdict({'tree_search_count': 2*n**2, 'cpuct': 1.0})
+    # one MCTS plays every game, bound the nodes it keeps
+    args = dotdict({'tree_search_count': 2*n**2, 'cpuct': 1.0, 'max_nodes': 200000, 'instrument': True})
     mcts = MCTS(game, model, args)
     def nnet_player(board): return mcts.calculate_p_v(board)
 
@@ -56,6 +66,11 @@ def test_MCTS_with_NNet(n, num_iter=100):
     ai, baseline, draw = bg.playGames(int(num_iter/2))
     perf = mcts.calculate_performance()
     print("--> Performance: {} node/step".format(perf))
+    print("--> Network batch: {} leaves/call".format(mcts.calculate_batch_size()))
+    print("--> Tree: {}".format(mcts.nodes.stats()))
+    print("--> Evaluation cache: {}".format(MCTS.eval_cache.stats()))
+    pd.DataFrame(mcts.stats.rows).to_csv(
+        './plots/search_nnet_{}x{}.csv'.format(n, n), sep=',')
     print("--> Result: AI/Baseline wins = {}/{}, AI win rate = {}\n".format(ai,
                                                                             baseline, ai/(ai + baseline + draw)))
     return (perf, ai/(ai + baseline + draw))
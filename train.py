@@ -1,5 +1,5 @@
-from battle import BattleGround
-from game import Game
+from battle import BattleGround, Resignation
+from game import Game, History
 from model import Model
 from mcts import MCTS
 import numpy as np
@@ -19,10 +19,14 @@ class Trainer():
         self.pnet = self.nnet.__class__(self.game)  # the competitor network
         self.args = args
         self.mcts = MCTS(self.game, self.nnet, self.args)
+        # args.resign_threshold lets a self-play game end early, None plays every game out
+        self.resignation = Resignation(self.args.get("resign_threshold"), self.args.get("resign_moves", 3),
+                                       self.args.get("resign_playout", 0.1))
 
         self.trainExamplesHistory = []
         self.loss_list = []
         self.win_rate_list = []
+        self.search_stats = []
         self.self_play_count = 0
 
     def self_play(self, training=False):
@@ -30,40 +34,51 @@ class Trainer():
         go through one run of self play and return training examples for nnet
         Returns: training examples of (standard_board, policy, win rate) 
         """
-        # to avoid kos
-        latest_two_s_a = []
+        # boards seen so far, for positional superko
+        history = History()
         pass_count = 0
+        self.resignation.new_game()
 
         training_examples = []
         episodeStep = 0
+        curr_player = 1
         board = self.game.get_init_board()
+        position = self.game.get_position(board, 1)
 
         while True:
             # check if game end
-            r = self.game.check_is_end(board, 1)
+            r = position.end
             if r != 0 or pass_count >= 2 or episodeStep > self.game.get_action_size()*2:
+                self.resignation.end_game(curr_player, r if r != 0 else self.game.get_current_win_lose(board, 1))
                 return training_examples
 
             episodeStep += 1
+            history.push(position.hash, position.flip_hash)
+
+            # playout cap randomization: only a full_search_prob share of the moves get the full
+            # search and become training examples, the others run a fast search to move the game on
+            full_search_prob = self.args.get("full_search_prob", 1.0)
+            full_search = full_search_prob >= 1 or np.random.random_sample() < full_search_prob
+            count = self.args.tree_search_count if full_search else self.args.fast_search_count
 
             # run mcts to get the training example from this root node
-            policy, v = self.mcts.calculate_p_v(board, temp=1)
+            policy, v = self.mcts.calculate_p_v(board, temp=1, history=history, count=count)
+            if self.resignation.resigns(curr_player, v):
+                return training_examples
 
             # get all symmetry board for robustness
-            symmetrics = self.game.get_all_perspectives(board, policy)
-            for b, p in symmetrics:
-                training_examples.append([b, p, v])
+            if full_search:
+                symmetrics = self.game.get_all_perspectives(board, policy)
+                for b, p in symmetrics:
+                    training_examples.append([b, p, v])
 
             # stop if exceed max step
             if episodeStep > self.game.get_action_size()*2:
+                self.resignation.end_game(curr_player, self.game.get_current_win_lose(board, 1))
                 return training_examples
 
-            # filter out ko actions
-            s = self.game.to_string(board)
-            valid_vector = self.game.get_valid_moves(board, 1)
-            for a_position, _ in np.ndenumerate(valid_vector):
-                if (s, a_position[0]) in latest_two_s_a:
-                    valid_vector[a_position] = 0
+            # moves repeating an earlier board are already filtered out
+            valid_vector = position.valid_moves[1]
 
             # re_normalize
             policy *= valid_vector
@@ -74,9 +89,7 @@ class Trainer():
             # must be movable
             if np.array(policy).sum() == 0:
                 pass_count += 1
-                board, curr_player = self.game.get_next_state(
-                    board, 1, -1)
-                continue
+                action = -1
             else:
                 # to encourage the model to explore
                 if training == True:
@@ -84,22 +97,19 @@ class Trainer():
                     p_sum = np.sum(policy)
                     policy /= p_sum
                 action = np.random.choice(len(policy), p=policy)
+                pass_count = 0
 
-            # record recent s to a
-            latest_two_s_a.append((s, action))
-            if len(latest_two_s_a) > 2:
-                latest_two_s_a.pop(0)
-
-            board, curr_player = self.game.get_next_state(
-                board, 1, action)
-            board = self.game.get_standard_board(
-                board, curr_player)
-
-            pass_count = 0
+            # one rules call gives the next board with its valid moves and end
+            position = self.game.get_next_position(
+                board, 1, action, history).standard()
+            history.turn()
+            curr_player = -curr_player
+            board = position.board
 
     def learn(self):
         self.loss_list = []
         self.win_rate_list = []
+        self.search_stats = []
         for i in range(1, self.args.iter_num+1):
             print(str(i) + 'th iteration at {} ->'.format(datetime.datetime.now().time()))
             iterationTrainExamples = []
@@ -107,11 +117,20 @@ class Trainer():
             for j in range(self.args.self_play_num):
                 print("self-play: {}".format(j))
                 self.self_play_count += 1
+                # stop the root-parallel workers of the last game, they hold the network of that game
+                self.mcts.close()
                 self.mcts = MCTS(self.game, self.nnet, self.args)
                 if self.self_play_count > 7:
                     iterationTrainExamples += self.self_play()
                 else:
                     self.self_play()
+                if self.mcts.stats is not None:
+                    self.search_stats += [dict(row, iteration=i, game=j) for row in self.mcts.stats.rows]
+            # no search while the network trains
+            self.mcts.close()
+            if self.args.get("resign_threshold") is not None:
+                print("resigned games: {}, false resignations: {}/{}".format(
+                    self.resignation.resigned, self.resignation.false_resigned, self.resignation.played_out))
 
             # save the iteration examples to the history
             self.trainExamplesHistory.append(iterationTrainExamples)
@@ -123,6 +142,8 @@ class Trainer():
             shuffle(trainExamples)
 
             loss = self.nnet.train(trainExamples)
+            # evaluations of the old weights can not be hit anymore, free them
+            MCTS.eval_cache.clear()
             self.loss_list.append(loss)
 
             result = test_MCTS_with_NNet(self.game, self.nnet,
@@ -140,6 +161,10 @@ class Trainer():
         df_win_rate = pd.DataFrame({'win_rate': self.win_rate_list})
         df_win_rate.to_csv('./plots/win_rate_{}x{}.csv'.format(
             *self.game.get_board_size()), sep=',')
+        if len(self.search_stats) > 0:
+            df_search = pd.DataFrame(self.search_stats)
+            df_search.to_csv('./plots/search_{}x{}.csv'.format(
+                *self.game.get_board_size()), sep=',')
 
 
 def test_MCTS_with_NNet(game, nnet, n):
@@ -174,7 +199,19 @@ args = dotdict({
     'iter_num': 100,
     'self_play_num': 32,
     'tree_search_count': 32,
+    # share of self-play moves searched with tree_search_count and recorded, fast_search_count for the rest
+    'full_search_prob': 1.0,
+    'fast_search_count': 8,
+    # resign below resign_threshold for resign_moves own moves in a row, None to play out every game;
+    # resign_playout of the games are played out anyway to count false resignations
+    'resign_threshold': None,
+    'resign_moves': 3,
+    'resign_playout': 0.1,
     'cpuct': 1,
+    'reuse_tree': True,
+    'eval_cache': True,
+    'gumbel': False,
+    'instrument': False,
     'checkpoint': './train'
 })
 